@@ -0,0 +1,315 @@
+"""
+AutoWatermark 命令行批处理入口, 不启动 Qt
+
+    python autowatermark.py photos/ "shoot/*.jpg" -o output -j 8
+    python -m autowatermark photos/ -r -o output --logo logos/sony.png
+    python autowatermark.py tethered/ -o proofs --watch
+    python autowatermark.py --serve 8765
+"""
+import argparse
+import logging
+import os
+import signal
+import sys
+import threading
+
+from utils.batch_utils import NAME_TEMPLATE, build_jobs, collect_images, default_workers, run_incremental_batch, \
+    skip_outputs
+from utils.encode_utils import DEFAULT_PROFILE, DEFAULT_RENDITIONS, available_profiles, available_rendition_sets, \
+    profile_report
+from utils.io_utils import PREFETCH_DEPTH, WRITER_THREADS
+from utils.service_utils import QUEUE_SIZE, SERVICE_HOST, SERVICE_PORT
+from utils.layout_utils import DEFAULT_LAYOUT, available_layouts
+from utils.trace_utils import JobLog, format_summary, summarize_records
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="autowatermark",
+                                     description="Add borders, camera information and logo to photos.")
+    parser.add_argument("inputs", nargs="*", help="image files, directories or glob patterns")
+    parser.add_argument("-o", "--output-dir", help="directory for rendered images (required unless --profile-report)")
+    parser.add_argument("-l", "--logo", help="use this logo for every image instead of detecting it from EXIF")
+    parser.add_argument("-j", "--workers", type=int, default=default_workers(),
+                        help="number of worker processes (default: %(default)s)")
+    parser.add_argument("-r", "--recursive", action="store_true",
+                        help="walk directories recursively and expand ** in glob patterns")
+    parser.add_argument("-n", "--name-template", default=NAME_TEMPLATE,
+                        help="output file name, {name} and {ext} are taken from the input and {suffix} from "
+                             "the rendition set (default: %(default)s)")
+    parser.add_argument("-p", "--profile", default=DEFAULT_PROFILE, choices=available_profiles(),
+                        help="output encoder profile from configs/output_profiles.json (default: %(default)s)")
+    parser.add_argument("-R", "--renditions", default=DEFAULT_RENDITIONS, choices=available_rendition_sets(),
+                        help="output sizes from configs/renditions.json, all rendered from one decode "
+                             "(default: %(default)s)")
+    parser.add_argument("-L", "--layout", default=DEFAULT_LAYOUT, choices=available_layouts(),
+                        help="border layout template from configs/layouts.json (default: %(default)s)")
+    parser.add_argument("--profile-report", action="store_true",
+                        help="render the inputs and report encoded size and time for every profile without saving")
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="re-render every image, even if the output manifest says it is up to date")
+    parser.add_argument("--prune", action="store_true",
+                        help="remove the outputs of every manifest entry whose source image no longer exists; "
+                             "by default only images missing from the scanned input directories are pruned")
+    parser.add_argument("--log", help="append a JSON Lines record with per-stage timings for every image, "
+                                      "followed by a batch summary record")
+    parser.add_argument("--catalog", nargs="?", const="", metavar="PATH",
+                        help="keep image metadata in a SQLite catalog (default: ~/.autowatermark/catalog.sqlite) "
+                             "and only re-read files that changed")
+    parser.add_argument("--make", help="with --catalog, only render images from this camera make (* and ? allowed)")
+    parser.add_argument("--model", help="with --catalog, only render images from this camera model")
+    parser.add_argument("--lens", help="with --catalog, only render images taken with this lens")
+    parser.add_argument("--catalog-report", action="store_true",
+                        help="update the catalog and print the images per camera and lens without rendering")
+    parser.add_argument("-w", "--watch", action="store_true",
+                        help="keep running and render new images as they are written to the input directories")
+    parser.add_argument("--settle", type=float, default=1.0,
+                        help="with --watch, seconds a file must stay unchanged before it is rendered (default: %(default)s)")
+    parser.add_argument("--pixel-budget", type=float, metavar="MP",
+                        help="megapixels rendered at the same time across all workers (default: derived from "
+                             "available memory); larger images are rendered one at a time")
+    parser.add_argument("--serve", nargs="?", type=int, const=SERVICE_PORT, metavar="PORT",
+                        help="run a local HTTP render service with warm workers instead of rendering inputs "
+                             f"(default port: {SERVICE_PORT})")
+    parser.add_argument("--host", default=SERVICE_HOST,
+                        help="with --serve, address to listen on (default: %(default)s)")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE,
+                        help="with --serve, requests waiting to be rendered before new ones are refused "
+                             "(default: %(default)s)")
+    parser.add_argument("--prefetch", type=int, default=PREFETCH_DEPTH, metavar="N",
+                        help="input files read ahead by a background thread, 0 lets the workers read them "
+                             "(default: %(default)s)")
+    parser.add_argument("--writers", type=int, default=WRITER_THREADS, metavar="N",
+                        help="background threads saving finished images, 0 lets the workers write them "
+                             "(default: %(default)s)")
+    parser.add_argument("-q", "--quiet", action="store_true", help="only report failures")
+    return parser.parse_args(argv)
+
+
+def print_profile_report(images, logo_path=None, layout=DEFAULT_LAYOUT):
+    """渲染每张输入图像, 按输出配置汇总编码后的总大小和耗时"""
+    from PIL import Image
+    from utils.exif_utils import find_logo_for_image
+    from utils.render_utils import add_borders_logo_and_text, WatermarkError
+
+    totals = {}
+    rendered = 0
+    for image_path in images:
+        # 与批处理相同: 给出 --logo 时用于每张图, 否则按相机厂商查找
+        logo = logo_path or find_logo_for_image(image_path)
+        try:
+            image = add_borders_logo_and_text(image_path, logo, preview=True, layout=layout)
+        except WatermarkError as e:
+            print(f"FAILED {image_path}: {e}", file=sys.stderr)
+            continue
+        rendered += 1
+        source_format = Image.registered_extensions().get(os.path.splitext(image_path)[1].lower())
+        for row in profile_report(image, source_format=source_format):
+            total = totals.setdefault(row['profile'], {'format': row['format'], 'bytes': 0, 'seconds': 0.0})
+            total['bytes'] += row['bytes']
+            total['seconds'] += row['seconds']
+
+    if not rendered:
+        return 1
+    print(f"{'profile':<12} {'format':<6} {'avg size':>10} {'avg time':>9}")
+    for name, total in totals.items():
+        print(f"{name:<12} {total['format']:<6} {total['bytes'] / rendered / 2 ** 20:>8.2f}MB "
+              f"{total['seconds'] / rendered:>8.3f}s")
+    return 0
+
+
+def pixel_budget(args):
+    return int(args.pixel_budget * 1e6) if args.pixel_budget else None
+
+
+def watch(args):
+    """--watch: 监视输入目录直到 Ctrl-C 或 SIGTERM, 停止时等待正在渲染的图像完成"""
+    from utils.watch_utils import watch_folders
+
+    directories = [item for item in args.inputs if os.path.isdir(item)]
+    if len(directories) != len(args.inputs):
+        print("--watch only accepts directories.", file=sys.stderr)
+        return 2
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    stop_event = threading.Event()
+
+    def stop(signum, frame):
+        # 第一次 Ctrl-C 只停止接收新文件并等待正在渲染的图像, 第二次直接退出
+        stop_event.set()
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    job_log = JobLog(args.log) if args.log else None
+    failed = 0
+
+    def report(done, pending, result):
+        nonlocal failed
+        if job_log is not None and result.record is not None:
+            job_log.write(result.record)
+        if not result.ok:
+            failed += 1
+            print(f"FAILED {result.image_path}: {result.error}", file=sys.stderr)
+        elif not args.quiet:
+            print(f"[{done}, {pending} waiting] {result.image_path} -> {result.output_path} ({result.elapsed:.2f}s)")
+
+    if not args.quiet:
+        print(f"Watching {', '.join(directories)}, press Ctrl-C to stop.", file=sys.stderr)
+    try:
+        try:
+            done = watch_folders(directories, args.logo, args.output_dir, auto_logo=args.logo is None,
+                                 workers=max(1, args.workers), recursive=args.recursive, settle=args.settle,
+                                 on_result=report, stop_event=stop_event, name_template=args.name_template,
+                                 pixel_budget=pixel_budget(args), profile=args.profile, layout=args.layout,
+                                 renditions=args.renditions, prune=args.prune)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 2
+    finally:
+        if job_log is not None:
+            job_log.close()
+    print(f"Stopped, {done - failed} rendered, {failed} failed.", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def open_catalog(args, images):
+    """扫描输入到目录中, 返回 (Catalog, 符合 --make/--model/--lens 的条目)"""
+    from utils.catalog_utils import CATALOG_PATH, Catalog
+
+    catalog = Catalog(args.catalog or CATALOG_PATH)
+    stats = catalog.scan(args.inputs, args.recursive)
+    if not args.quiet:
+        print(f"catalog: {stats['scanned']} images, {stats['updated']} read, {stats['unchanged']} unchanged, "
+              f"{stats['removed']} removed ({stats['seconds']:.2f}s)", file=sys.stderr)
+    entries = catalog.query(paths=images, make=args.make, model=args.model, lens=args.lens)
+    return catalog, entries
+
+
+def print_catalog_report(catalog, entries):
+    paths = [entry.path for entry in entries]
+    for column in ('model', 'lens'):
+        print(f"{column}:")
+        for value, count in catalog.group_by(column, paths=paths):
+            print(f"  {count:>6}  {value or 'unknown'}")
+    failed = [entry for entry in entries if entry.error is not None]
+    for entry in failed:
+        print(f"unreadable: {entry.path}: {entry.error}", file=sys.stderr)
+    return 0
+
+
+def serve(args):
+    """--serve: 运行本机渲染服务直到 Ctrl-C 或 SIGTERM"""
+    from utils.service_utils import serve as run_service
+
+    stop_event = threading.Event()
+
+    def stop(signum, frame):
+        stop_event.set()
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    def ready(address):
+        print(f"Serving on http://{address[0]}:{address[1]} with {max(1, args.workers)} warm workers, "
+              f"press Ctrl-C to stop.", file=sys.stderr)
+
+    try:
+        run_service(args.host, args.serve, max(1, args.workers), max(1, args.queue_size), stop_event=stop_event,
+                    on_ready=ready, layout=args.layout)
+    except OSError as e:
+        print(f"Cannot serve on {args.host}:{args.serve}: {e}", file=sys.stderr)
+        return 1
+    print("Stopped.", file=sys.stderr)
+    return 0
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(name)s: %(message)s")
+
+    if args.serve is not None:
+        return serve(args)
+    if not args.inputs:
+        print("No inputs given.", file=sys.stderr)
+        return 2
+    if args.watch:
+        if not args.output_dir:
+            print("--output-dir is required.", file=sys.stderr)
+            return 2
+        return watch(args)
+
+    images = collect_images(args.inputs, args.recursive)
+    if args.output_dir:
+        # 输出目录位于输入目录中时, 不把上次的输出当作输入
+        images = skip_outputs(images, args.output_dir, args.inputs)
+    if not images:
+        print("No images found.", file=sys.stderr)
+        return 2
+    entries = None
+    if args.catalog is not None or args.catalog_report or args.make or args.model or args.lens:
+        catalog, entries = open_catalog(args, images)
+        try:
+            if args.catalog_report:
+                return print_catalog_report(catalog, entries)
+        finally:
+            catalog.close()
+        images = [entry.path for entry in entries if entry.error is None]
+        if not images:
+            print("No images match.", file=sys.stderr)
+            return 2
+    if args.profile_report:
+        return print_profile_report(images, args.logo, args.layout)
+    if not args.output_dir:
+        print("--output-dir is required.", file=sys.stderr)
+        return 2
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    job_options = dict(name_template=args.name_template, profile=args.profile, layout=args.layout,
+                       renditions=args.renditions)
+    try:
+        if entries is not None and args.logo is None:
+            from utils.catalog_utils import build_catalog_jobs
+            jobs = build_catalog_jobs(entries, None, args.output_dir, **job_options)
+        else:
+            jobs = build_jobs(images, args.logo, args.output_dir, auto_logo=args.logo is None, **job_options)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    job_log = JobLog(args.log) if args.log else None
+
+    def report(done, total, result):
+        if job_log is not None and result.record is not None:
+            job_log.write(result.record)
+        if not result.ok:
+            print(f"[{done}/{total}] FAILED {result.image_path}: {result.error}", file=sys.stderr)
+        elif not args.quiet:
+            print(f"[{done}/{total}] {result.image_path} -> {result.output_path} "
+                  f"({result.elapsed:.2f}s, peak {result.peak_bytes / 2 ** 20:.0f} MB)")
+
+    try:
+        results, skipped, pruned = run_incremental_batch(jobs, args.output_dir, max(1, args.workers),
+                                                         on_result=report, force=args.force,
+                                                         roots=[item for item in args.inputs if os.path.isdir(item)],
+                                                         recursive=args.recursive, prune=args.prune,
+                                                         pixel_budget=pixel_budget(args),
+                                                         prefetch=max(0, args.prefetch), writers=max(0, args.writers))
+        summary = summarize_records([result.record for result in results
+                                     if result.record is not None and result.ok])
+        if job_log is not None:
+            job_log.write({'summary': summary})
+    finally:
+        if job_log is not None:
+            job_log.close()
+
+    failed = sum(1 for result in results if not result.ok)
+    if not args.quiet:
+        print(format_summary(summary), file=sys.stderr)
+    print(f"{len(results) - failed} succeeded, {failed} failed, {len(skipped)} unchanged, "
+          f"{len(pruned)} stale outputs removed.", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,358 @@
+"""
+渲染流程基准测试: 解码 -> 旋转 -> 合成 -> 编码, 以及 utils/exif_utils.py 中的 EXIF 辅助函数
+
+测试图像由 piexif 和 Pillow 离线生成 (12/24/45/61 MP, logos/ 中每个厂商一张), 结果写成 JSON,
+可以用 --compare 对比两个版本:
+
+    python benchmarks/pipeline_benchmark.py --sizes 12 24 --workers 1 4 8
+    python benchmarks/pipeline_benchmark.py --compare results/old.json results/new.json
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import piexif
+import PIL
+from PIL import Image
+
+from utils.batch_utils import BudgetedPool, build_jobs, run_batch
+from utils.encode_utils import DEFAULT_PROFILE, encode_image, get_output_profile
+from utils.exif_utils import clear_metadata_cache, find_logo, get_exif_data, get_exif_table, get_manufacturer, get_metadata, \
+    get_output_exif
+from utils.image_utils import oriented_size, reset_image_orientation
+from utils.layout_utils import DEFAULT_LAYOUT, get_layout_plan
+from utils.logo_utils import get_logo_registry
+from utils.render_utils import compose_watermark, compose_watermark_low_memory, load_camera_info, load_logo
+
+# 3:2 画幅下各像素数对应的尺寸
+IMAGE_SIZES = {
+    12: (4240, 2832),
+    24: (6000, 4000),
+    45: (8256, 5504),
+    61: (9504, 6336),
+}
+
+# logos/ 中的品牌 -> (EXIF Make, Model, LensModel)
+CAMERAS = {
+    'apple': (b"Apple", b"iPhone 15 Pro", b"iPhone 15 Pro back triple camera 6.765mm f/1.78"),
+    'canon': (b"Canon", b"Canon EOS R5", b"RF24-70mm F2.8 L IS USM"),
+    'dji': (b"DJI", b"FC8482", b"24.0 mm f/1.7"),
+    'fujifilm': (b"FUJIFILM", b"X-T5", b"XF16-55mmF2.8 R LM WR"),
+    'hasselblad': (b"Hasselblad", b"X2D 100C", b"XCD 55V"),
+    'leica': (b"LEICA CAMERA AG", b"LEICA Q3", b"SUMMILUX 1:1.7/28 ASPH."),
+    'nikon': (b"NIKON CORPORATION", b"NIKON Z 8", b"NIKKOR Z 24-120mm f/4 S"),
+    'olympus': (b"OM Digital Solutions", b"OM-1", b"M.Zuiko Digital ED 12-40mm F2.8 PRO II"),
+    'panasonic': (b"Panasonic", b"DC-S5M2", b"LUMIX S 20-60/F3.5-5.6"),
+    'pentax': (b"PENTAX", b"PENTAX K-3 Mark III", b"HD PENTAX-DA 16-85mm F3.5-5.6ED DC WR"),
+    'ricoh': (b"RICOH IMAGING COMPANY, LTD.", b"RICOH GR III", b"GR LENS 18.3mm F2.8"),
+    'sony': (b"SONY", b"ILCE-7RM5", b"FE 24-70mm F2.8 GM II"),
+    'xmage': (b"HUAWEI", b"ALN-AL00", b"HUAWEI Mate 60 Pro Main Camera"),
+}
+
+STAGES = ('metadata', 'get_manufacturer', 'get_exif_table', 'get_exif_data', 'logo_lookup', 'logo_load', 'decode', 'orient', 'compose', 'encode',
+          'compose_low_memory')
+
+
+def make_exif(brand, orientation=1):
+    make, model, lens = CAMERAS[brand]
+    exif = {
+        "0th": {
+            piexif.ImageIFD.Make: make,
+            piexif.ImageIFD.Model: model,
+            piexif.ImageIFD.Orientation: orientation,
+        },
+        "Exif": {
+            piexif.ExifIFD.LensModel: lens,
+            piexif.ExifIFD.FocalLength: (50, 1),
+            piexif.ExifIFD.FocalLengthIn35mmFilm: 50,
+            piexif.ExifIFD.FNumber: (28, 10),
+            piexif.ExifIFD.ExposureTime: (1, 250),
+            piexif.ExifIFD.ISOSpeedRatings: 200,
+            piexif.ExifIFD.DateTimeOriginal: b"2024:05:01 10:11:12",
+        },
+    }
+    return piexif.dump(exif)
+
+
+def make_image(size):
+    """噪声加渐变的合成照片, 压缩率接近真实照片"""
+    width, height = size
+    noise = Image.effect_noise((width // 4, height // 4), 40).resize(size, Image.BILINEAR)
+    gradient = Image.linear_gradient('L').resize(size)
+    return Image.merge('RGB', (noise, gradient, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+
+
+def build_dataset(cache_dir, megapixels, brands):
+    """生成测试图像, 已存在的文件直接复用; 返回 [(路径, 像素数档位, 品牌)]"""
+    os.makedirs(cache_dir, exist_ok=True)
+    dataset = []
+    for mp in megapixels:
+        base = None
+        for brand in brands:
+            path = os.path.join(cache_dir, f"{mp}mp_{brand}.jpg")
+            if not os.path.isfile(path):
+                if base is None:
+                    base = make_image(IMAGE_SIZES[mp])
+                base.save(path, quality=90, exif=make_exif(brand))
+            dataset.append((path, mp, brand))
+    return dataset
+
+
+def timed(stage, timings, function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    timings[stage] = time.perf_counter() - start
+    return result
+
+
+def time_stages(image_path, output_dir, profile):
+    """逐个阶段运行一次渲染流程, 返回每个阶段的耗时 (秒)"""
+    timings = {}
+    clear_metadata_cache()
+
+    metadata = timed('metadata', timings, get_metadata, image_path)
+
+    # exif_utils 中的辅助函数分别计时, 每个都从冷缓存开始, 计入各自读取和解析 EXIF 的开销
+    for helper in (get_manufacturer, get_exif_table, get_exif_data):
+        clear_metadata_cache()
+        timed(helper.__name__, timings, helper, image_path)
+    camera_info, shooting_info = load_camera_info(image_path, metadata)
+
+    logo_path = timed('logo_lookup', timings, find_logo, get_manufacturer(image_path))
+    get_logo_registry()._resized.clear()
+    plan = get_layout_plan(DEFAULT_LAYOUT, *oriented_size(metadata.width, metadata.height, metadata.orientation))
+    logo = timed('logo_load', timings, load_logo, logo_path, plan.logo_height)
+
+    def decode():
+        image = Image.open(image_path)
+        image.load()
+        return image
+    image = timed('decode', timings, decode)
+    image = timed('orient', timings, reset_image_orientation, image, metadata.orientation)
+    new_image = timed('compose', timings, compose_watermark, image, camera_info, shooting_info, logo, plan)
+    del image
+
+    output_path = os.path.join(output_dir, os.path.basename(image_path))
+    timed('encode', timings, encode_image, new_image, output_path, profile, get_output_exif(metadata))
+    del new_image
+
+    # 低内存模式的解码和合成在同一步中完成
+    new_image = timed('compose_low_memory', timings, compose_watermark_low_memory,
+                      image_path, metadata, camera_info, shooting_info, logo, plan)
+    del new_image
+    return timings
+
+
+def summarize(values):
+    values = sorted(values)
+    return {
+        'mean': statistics.fmean(values),
+        'median': statistics.median(values),
+        'min': values[0],
+        'max': values[-1],
+    }
+
+
+def run_stage_benchmark(dataset, repeat, profile):
+    output_dir = tempfile.mkdtemp(prefix="autowatermark-stages-")
+    results = {}
+    try:
+        for mp in sorted({mp for _, mp, _ in dataset}):
+            samples = {stage: [] for stage in STAGES}
+            for image_path, image_mp, brand in dataset:
+                if image_mp != mp:
+                    continue
+                for _ in range(repeat):
+                    for stage, seconds in time_stages(image_path, output_dir, profile).items():
+                        samples[stage].append(seconds)
+            results[f"{mp}mp"] = {stage: summarize(values) for stage, values in samples.items() if values}
+            print(f"{mp:>3} MP  " + "  ".join(f"{stage} {results[f'{mp}mp'][stage]['median'] * 1000:.0f}ms"
+                                              for stage in STAGES), file=sys.stderr)
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+    return results
+
+
+def process_tree_rss(pid):
+    """pid 及其所有子进程的 RSS 之和 (字节), 只支持 Linux 的 /proc"""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pending.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            continue
+    return total
+
+
+def throughput_worker(image_paths, megapixels, workers, profile, queue):
+    """在独立进程中运行一次批处理, 避免 RSS 峰值受前一次测量影响"""
+    output_dir = tempfile.mkdtemp(prefix="autowatermark-throughput-")
+    peak = 0
+    stop = threading.Event()
+
+    def sample():
+        nonlocal peak
+        while not stop.wait(0.05):
+            peak = max(peak, process_tree_rss(os.getpid()))
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+
+    try:
+        jobs = build_jobs(image_paths, None, output_dir, profile=profile)
+        # 进程启动和导入单独计时, 吞吐量只统计预热之后的渲染
+        pool = None
+        start = time.perf_counter()
+        if workers > 1:
+            pool = BudgetedPool(workers)
+            pool.start()
+        startup = time.perf_counter() - start
+        try:
+            start = time.perf_counter()
+            results = run_batch(jobs, workers, pool=pool)
+            elapsed = time.perf_counter() - start
+        finally:
+            if pool is not None:
+                pool.close()
+    finally:
+        stop.set()
+        sampler.join()
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    # workers 为 1 时在本进程中渲染, 否则取最大的工作进程
+    max_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    queue.put({
+        'workers': workers,
+        'images': len(jobs),
+        'failed': sum(1 for result in results if not result.ok),
+        'startup_seconds': startup,
+        'seconds': elapsed,
+        'images_per_second': len(jobs) / elapsed if elapsed else 0.0,
+        'megapixels_per_second': megapixels / elapsed if elapsed else 0.0,
+        'peak_rss_total_mb': peak / 2 ** 20 if peak else None,
+        'peak_rss_process_mb': (max_rss if sys.platform != 'darwin' else max_rss / 1024) / 1024,
+    })
+
+
+def run_throughput_benchmark(dataset, worker_counts, profile):
+    context = multiprocessing.get_context("spawn")
+    image_paths = [image_path for image_path, _, _ in dataset]
+    megapixels = sum(mp for _, mp, _ in dataset)
+    results = []
+    for workers in worker_counts:
+        queue = context.Queue()
+        process = context.Process(target=throughput_worker, args=(image_paths, megapixels, workers, profile, queue))
+        process.start()
+        result = queue.get()
+        process.join()
+        results.append(result)
+        print(f"{workers:>3} workers  {result['images_per_second']:.2f} images/s  "
+              f"start-up {result['startup_seconds']:.2f}s  peak RSS {result['peak_rss_total_mb'] or 0:.0f} MB", file=sys.stderr)
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'pillow': PIL.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare(old_path, new_path):
+    """打印两次结果中各阶段中位数和吞吐量的变化, 比值小于 1 表示新版本更快"""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{old['environment'].get('commit')} -> {new['environment'].get('commit')}")
+    for size, stages in new.get('stages', {}).items():
+        for stage, summary in stages.items():
+            before = old.get('stages', {}).get(size, {}).get(stage)
+            if before:
+                ratio = summary['median'] / before['median'] if before['median'] else float('nan')
+                print(f"{size:>5} {stage:<20} {before['median'] * 1000:>9.1f}ms -> {summary['median'] * 1000:>9.1f}ms  x{ratio:.2f}")
+    old_throughput = {result['workers']: result for result in old.get('throughput', [])}
+    for result in new.get('throughput', []):
+        before = old_throughput.get(result['workers'])
+        if before:
+            print(f"{result['workers']:>3} workers  {before['images_per_second']:.2f} -> "
+                  f"{result['images_per_second']:.2f} images/s")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the AutoWatermark rendering pipeline.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=sorted(IMAGE_SIZES), choices=sorted(IMAGE_SIZES),
+                        help="megapixel sizes of the synthetic images (default: %(default)s)")
+    parser.add_argument("--brands", nargs="+", default=sorted(CAMERAS), choices=sorted(CAMERAS),
+                        help="camera makes to generate, one image per make and size (default: all)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4],
+                        help="worker counts for the throughput run (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=1, help="stage timing repetitions per image")
+    parser.add_argument("--profile", default=DEFAULT_PROFILE, help="output profile used for encoding")
+    parser.add_argument("--skip-stages", action="store_true", help="only measure throughput")
+    parser.add_argument("--skip-throughput", action="store_true", help="only measure stage timings")
+    parser.add_argument("--cache-dir", default=os.path.join(tempfile.gettempdir(), "autowatermark-bench"),
+                        help="where synthetic images are generated and reused (default: %(default)s)")
+    parser.add_argument("--output", default=None,
+                        help="result file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.compare:
+        compare(*args.compare)
+        return 0
+
+    profile = get_output_profile(args.profile)
+    dataset = build_dataset(args.cache_dir, args.sizes, args.brands)
+
+    results = {'environment': environment(), 'settings': vars(args)}
+    if not args.skip_stages:
+        results['stages'] = run_stage_benchmark(dataset, args.repeat, profile)
+    if not args.skip_throughput:
+        results['throughput'] = run_throughput_benchmark(dataset, args.workers, args.profile)
+
+    output = args.output or os.path.join(ROOT_DIR, "benchmarks", "results",
+                                         datetime.datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,13 @@
 from utils.exif_utils import *
 from utils.image_utils import *
+from utils.render_utils import *
+from utils.batch_utils import *
+from utils.logo_utils import get_logo_registry
+from utils.trace_utils import JobLog, format_summary, summarize_records
+from utils.encode_utils import DEFAULT_PROFILE, DEFAULT_RENDITIONS, available_profiles, available_rendition_sets, \
+    get_output_profile, get_rendition_set
+from utils.thumbnail_utils import ThumbnailCache
+from utils.layout_utils import DEFAULT_LAYOUT, available_layouts, get_layout
 
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtWidgets import QFileDialog, QMessageBox, QLabel, QHBoxLayout, QScrollArea, QTableWidget, QTableWidgetItem
@@ -8,15 +16,85 @@ from PyQt5.QtGui import QFont, QFontDatabase
 
 import os
 import json
+import logging
+import threading
 
-EDGE_WIDTH = 400
-EDGE_WIDTH_SIDE = 150
-FONT_SIZE = 90
+# 界面批处理的耗时日志放在用户目录下, 不写入输出目录
+JOB_LOG_PATH = os.path.join(os.path.expanduser('~'), '.autowatermark', 'autowatermark_log.jsonl')
 
-IMAGE_SIZE = 6000 * 5000
+logger = logging.getLogger(__name__)
 
-GLOBAL_FONT_PATH_BOLD = "./fonts/AlibabaPuHuiTi-2-85-Bold.otf"
-GLOBAL_FONT_PATH_LIGHT = "./fonts/Roboto-Regular.ttf"
+_qt_font_families = {}
+
+
+def load_qt_font(font_path):
+    """每个字体文件只注册一次, 注册失败时使用系统默认字体"""
+    if font_path not in _qt_font_families:
+        families = []
+        if font_path is not None:
+            families = QFontDatabase.applicationFontFamilies(QFontDatabase.addApplicationFont(font_path))
+        _qt_font_families[font_path] = families[0] if families else None
+    family = _qt_font_families[font_path]
+    return QFont(family) if family is not None else QFont()
+
+
+class BatchWorker(QtCore.QObject):
+    """在后台线程中执行 run_incremental_batch, 通过信号把进度传回界面"""
+    progress = QtCore.pyqtSignal(int, int, str)
+    finished = QtCore.pyqtSignal(list, int)
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, jobs, workers, output_dir, force=False):
+        super().__init__()
+        self.jobs = jobs
+        self.workers = workers
+        self.output_dir = output_dir
+        self.force = force
+        self.cancel_event = threading.Event()
+
+    def run(self):
+        # 读取清单和计算 logo 哈希也放在后台线程中; 出错时也要发出 finished, 否则界面一直处于运行状态
+        results, skipped = [], []
+        try:
+            results, skipped, _ = run_incremental_batch(
+                self.jobs, self.output_dir, self.workers,
+                on_result=lambda done, total, result: self.progress.emit(done, total, result.image_path),
+                cancel_event=self.cancel_event, force=self.force)
+        except Exception as e:
+            logger.exception("Batch failed")
+            self.failed.emit(str(e) or type(e).__name__)
+        finally:
+            self.finished.emit(results, len(skipped))
+
+    def cancel(self):
+        self.cancel_event.set()
+
+
+class TaskSignals(QtCore.QObject):
+    """QRunnable 不是 QObject, 通过共享的信号对象把结果传回界面线程"""
+    done = QtCore.pyqtSignal(str, object)
+    failed = QtCore.pyqtSignal(str, str)
+
+
+class BackgroundTask(QtCore.QRunnable):
+    """在 QThreadPool 中执行 func(image_path), 结果以 image_path 为键通过 signals 发出"""
+
+    def __init__(self, signals, func, image_path):
+        super().__init__()
+        self.signals = signals
+        self.func = func
+        self.image_path = image_path
+
+    def run(self):
+        try:
+            result = self.func(self.image_path)
+        except Exception as e:
+            self.signals.failed.emit(self.image_path, str(e))
+            return
+        self.signals.done.emit(self.image_path, result)
+
+
+THUMBNAIL_ICON_SIZE = 80
 
 
 class ImageWatermarkApp(QtWidgets.QWidget):
@@ -30,7 +108,22 @@ class ImageWatermarkApp(QtWidgets.QWidget):
         
         with open('configs/i18n.json', 'r', encoding='utf-8') as f:
             self.translations = json.load(f)
-        
+
+        get_logo_registry()  # 启动时建立 logo 索引
+
+        # 缩略图和选中图像都在线程池中解码, 界面线程只做显示
+        self.thumbnail_cache = ThumbnailCache()
+        self.thumbnail_pool = QtCore.QThreadPool(self)
+        self.thumbnail_pool.setMaxThreadCount(max(1, min(4, default_workers())))
+        self.thumbnail_items = {}
+        self.thumbnail_signals = TaskSignals(self)
+        self.thumbnail_signals.done.connect(self.on_thumbnail_loaded)
+        self.thumbnail_signals.failed.connect(self.on_thumbnail_failed)
+        self.selected_image_path = None
+        self.selected_image_signals = TaskSignals(self)
+        self.selected_image_signals.done.connect(self.on_selected_image_loaded)
+        self.selected_image_signals.failed.connect(self.on_selected_image_failed)
+
         self.init_ui()
 
     def init_ui(self):
@@ -46,14 +139,8 @@ class ImageWatermarkApp(QtWidgets.QWidget):
         # 左侧布局
         left_layout = QtWidgets.QVBoxLayout()
         
-        bold_font_id = QFontDatabase.addApplicationFont(GLOBAL_FONT_PATH_BOLD)
-        light_font_id = QFontDatabase.addApplicationFont(GLOBAL_FONT_PATH_LIGHT)
-        bold_font_families = QFontDatabase.applicationFontFamilies(bold_font_id)
-        light_font_families = QFontDatabase.applicationFontFamilies(light_font_id)
-        bold_qfont = QFont(bold_font_families[0])
-        light_qfont = QFont(light_font_families[0]) 
-        bold_font = QFont(bold_qfont)
-        light_font  = QFont(light_qfont)
+        bold_font = load_qt_font(GLOBAL_FONT_PATH_BOLD)
+        light_font = load_qt_font(GLOBAL_FONT_PATH_LIGHT)
 
         # 创建按钮和标签
         self.images_path_label = QtWidgets.QLabel(self.translations[self.current_language]['images_path'])
@@ -86,9 +173,58 @@ class ImageWatermarkApp(QtWidgets.QWidget):
         self.run_button.setFont(bold_font)
         self.preview_button.setFont(bold_font)
 
+        self.cancel_button = QtWidgets.QPushButton(self.translations[self.current_language]['cancel'])
+        self.cancel_button.setFont(bold_font)
+        self.cancel_button.setEnabled(False)
+
         button_layout = QtWidgets.QHBoxLayout()
         button_layout.addWidget(self.run_button)
         button_layout.addWidget(self.preview_button)
+        button_layout.addWidget(self.cancel_button)
+
+        self.workers_label = QtWidgets.QLabel(self.translations[self.current_language]['workers'])
+        self.workers_spin = QtWidgets.QSpinBox()
+        self.workers_spin.setRange(1, default_workers())
+        self.workers_spin.setValue(default_workers())
+        self.workers_label.setFont(bold_font)
+        self.workers_spin.setFont(light_font)
+
+        self.profile_label = QtWidgets.QLabel(self.translations[self.current_language]['output_profile'])
+        self.profile_combo = QtWidgets.QComboBox()
+        for name in available_profiles():
+            self.profile_combo.addItem(name)
+            self.profile_combo.setItemData(self.profile_combo.count() - 1,
+                                           get_output_profile(name).description, QtCore.Qt.ToolTipRole)
+        self.profile_combo.setCurrentText(DEFAULT_PROFILE)
+        self.profile_label.setFont(bold_font)
+        self.profile_combo.setFont(light_font)
+
+        self.layout_label = QtWidgets.QLabel(self.translations[self.current_language]['layout'])
+        self.layout_combo = QtWidgets.QComboBox()
+        for name in available_layouts():
+            self.layout_combo.addItem(name)
+            self.layout_combo.setItemData(self.layout_combo.count() - 1,
+                                          get_layout(name).description, QtCore.Qt.ToolTipRole)
+        self.layout_combo.setCurrentText(DEFAULT_LAYOUT)
+        self.layout_label.setFont(bold_font)
+        self.layout_combo.setFont(light_font)
+
+        self.renditions_label = QtWidgets.QLabel(self.translations[self.current_language]['renditions'])
+        self.renditions_combo = QtWidgets.QComboBox()
+        for name in available_rendition_sets():
+            self.renditions_combo.addItem(name)
+            self.renditions_combo.setItemData(self.renditions_combo.count() - 1,
+                                              get_rendition_set(name).description, QtCore.Qt.ToolTipRole)
+        self.renditions_combo.setCurrentText(DEFAULT_RENDITIONS)
+        self.renditions_label.setFont(bold_font)
+        self.renditions_combo.setFont(light_font)
+
+        self.force_check = QtWidgets.QCheckBox(self.translations[self.current_language]['force_rerender'])
+        self.force_check.setFont(light_font)
+
+        self.progress_bar = QtWidgets.QProgressBar()
+        self.progress_bar.setFont(light_font)
+        self.progress_bar.setValue(0)
 
         self.exif_info_table = QTableWidget(1, 4)
         self.exif_info_table.setHorizontalHeaderLabels([
@@ -136,11 +272,17 @@ class ImageWatermarkApp(QtWidgets.QWidget):
         form_layout.addRow(self.logo_browse_button)
         form_layout.addRow(self.output_dir_label, self.output_dir_edit)
         form_layout.addRow(self.output_browse_button)
+        form_layout.addRow(self.workers_label, self.workers_spin)
+        form_layout.addRow(self.profile_label, self.profile_combo)
+        form_layout.addRow(self.layout_label, self.layout_combo)
+        form_layout.addRow(self.renditions_label, self.renditions_combo)
+        form_layout.addRow(self.force_check)
 
         left_layout.addLayout(form_layout)
         left_layout.addWidget(self.exif_info_table)
         # left_layout.addWidget(self.selected_image_label)  # 添加选定图片展示区域
         left_layout.addLayout(button_layout)
+        left_layout.addWidget(self.progress_bar)
 
         # 设置布局间距
         left_layout.setContentsMargins(10, 10, 10, 10)
@@ -158,6 +300,18 @@ class ImageWatermarkApp(QtWidgets.QWidget):
         self.scroll_area.setWidgetResizable(True)
         self.scroll_area.setFixedSize(800, 600)
 
+        self.thumbnail_list = QtWidgets.QListWidget()
+        self.thumbnail_list.setViewMode(QtWidgets.QListView.IconMode)
+        self.thumbnail_list.setFlow(QtWidgets.QListView.LeftToRight)
+        self.thumbnail_list.setWrapping(False)
+        self.thumbnail_list.setMovement(QtWidgets.QListView.Static)
+        self.thumbnail_list.setUniformItemSizes(True)
+        self.thumbnail_list.setIconSize(QtCore.QSize(THUMBNAIL_ICON_SIZE, THUMBNAIL_ICON_SIZE))
+        self.thumbnail_list.setGridSize(QtCore.QSize(THUMBNAIL_ICON_SIZE + 20, THUMBNAIL_ICON_SIZE + 24))
+        self.thumbnail_list.setFixedSize(800, THUMBNAIL_ICON_SIZE + 44)
+        self.thumbnail_list.setFont(light_font)
+        self.thumbnail_list.currentItemChanged.connect(self.on_thumbnail_selected)
+
         self.selected_image_label = QLabel()
         self.selected_image_label.setFixedSize(600, 400)
         self.selected_image_label.setAlignment(QtCore.Qt.AlignCenter)
@@ -169,6 +323,7 @@ class ImageWatermarkApp(QtWidgets.QWidget):
 
         left_layout.addWidget(self.scroll_area_selected, stretch = 3)
         right_layout.addWidget(self.scroll_area, stretch = 3)
+        right_layout.addWidget(self.thumbnail_list)  # 所选图像的缩略图列表
 
         # 将左右布局添加到主布局
         main_layout.addLayout(left_layout, stretch = 1)
@@ -210,6 +365,11 @@ class ImageWatermarkApp(QtWidgets.QWidget):
         self.output_browse_button.clicked.connect(self.browse_output_dir)
         self.run_button.clicked.connect(self.run)
         self.preview_button.clicked.connect(self.preview)
+        self.cancel_button.clicked.connect(self.cancel_run)
+
+        self.batch_thread = None
+        self.batch_worker = None
+        self.batch_error = None
 
     def set_font(self, font, *widgets):
         """设置多个控件的字体"""
@@ -217,11 +377,8 @@ class ImageWatermarkApp(QtWidgets.QWidget):
             widget.setFont(font)
     
     def show_message_box(self, title, text, msg_type='information'):
-        bold_font_id = QFontDatabase.addApplicationFont(GLOBAL_FONT_PATH_BOLD)
-        bold_font_families = QFontDatabase.applicationFontFamilies(bold_font_id)
-        bold_qfont = QFont(bold_font_families[0])
-        bold_font = QFont(bold_qfont)
-        
+        bold_font = load_qt_font(GLOBAL_FONT_PATH_BOLD)
+
         msg_box = QMessageBox()
         msg_box.setWindowTitle(title)
         msg_box.setText(text)
@@ -241,8 +398,8 @@ class ImageWatermarkApp(QtWidgets.QWidget):
         files, _ = QFileDialog.getOpenFileNames(self, 'Select Images', '', 'Image Files (*.jpg *.jpeg *.png)')
         if files:
             self.images_path_edit.setText(';'.join(files))
-            if get_manufacturer(files[0]) is not None:
-                manufacturer = get_manufacturer(files[0])
+            manufacturer = get_manufacturer(files[0])
+            if manufacturer is not None:
                 logo_path = find_logo(manufacturer)
                 if logo_path:
                     self.logo_path_edit.setText(logo_path)
@@ -251,15 +408,73 @@ class ImageWatermarkApp(QtWidgets.QWidget):
                                       self.translations[self.current_language]['no_device'], 
                                       'critical')
                 # return
-            
-            self.display_exif_info(files[0])
-            self.display_selected_image(files[0])  # 显示选定的图片
 
+            self.load_thumbnails(files)  # 选中第一张, 显示 EXIF 和图片
+
+    def load_thumbnails(self, files):
+        """为每个文件添加占位条目, 缩略图在线程池中按顺序解码"""
+        self.thumbnail_pool.clear()  # 丢弃上一次选择中还没开始的任务
+        self.thumbnail_list.blockSignals(True)
+        self.thumbnail_list.clear()
+        self.thumbnail_list.blockSignals(False)
+        self.thumbnail_items = {}
+        for image_path in files:
+            item = QtWidgets.QListWidgetItem(os.path.basename(image_path))
+            item.setData(QtCore.Qt.UserRole, image_path)
+            item.setToolTip(image_path)
+            self.thumbnail_items[image_path] = item
+            self.thumbnail_list.addItem(item)
+            entry = self.thumbnail_cache.get(image_path)
+            if entry is not None:
+                self.on_thumbnail_loaded(image_path, entry)
+            else:
+                self.thumbnail_pool.start(BackgroundTask(self.thumbnail_signals, self.thumbnail_cache.load, image_path))
+        if files:
+            self.thumbnail_list.setCurrentRow(0)
+
+    def on_thumbnail_loaded(self, image_path, entry):
+        item = self.thumbnail_items.get(image_path)
+        if item is None:
+            return  # 已经重新选择了文件
+        image, _ = entry
+        item.setIcon(QtGui.QIcon(QtGui.QPixmap.fromImage(pil_image_to_qimage(image))))
+
+    def on_thumbnail_failed(self, image_path, error):
+        logger.warning("Error loading thumbnail %s: %s", image_path, error)
+
+    def on_thumbnail_selected(self, item, previous=None):
+        if item is None:
+            return
+        image_path = item.data(QtCore.Qt.UserRole)
+        entry = self.thumbnail_cache.get(image_path)
+        self.display_exif_info(image_path, entry[1] if entry is not None else None)
+        if entry is not None:
+            # 先放大显示缩略图, 清晰的图像在后台解码完成后替换
+            self.show_selected_image(entry[0])
+        self.display_selected_image(image_path)
 
     def display_selected_image(self, image_path):
-        image = Image.open(image_path)
-        image = reset_image_orientation(image)  # Reset orientation
-        qt_image = pil_image_to_qimage(image)
+        # 只按显示区域大小解码, 不解码全尺寸图像, 解码在线程池中进行
+        self.selected_image_path = image_path
+        display_size = max(self.selected_image_label.width(), self.selected_image_label.height()) * 2
+
+        def load(path):
+            return load_reduced_image(path, get_metadata(path).orientation, (display_size, display_size))
+
+        self.thumbnail_pool.start(BackgroundTask(self.selected_image_signals, load, image_path), 1)
+
+    def on_selected_image_loaded(self, image_path, image):
+        if image_path == self.selected_image_path:
+            self.show_selected_image(image)
+
+    def on_selected_image_failed(self, image_path, error):
+        logger.warning("Error displaying %s: %s", image_path, error)
+
+    def show_selected_image(self, image):
+        # 铺满显示区域所需的尺寸, 只转换这么多像素
+        label_width, label_height = self.selected_image_label.width(), self.selected_image_label.height()
+        scale = max(label_width / image.width, label_height / image.height)
+        qt_image = pil_image_to_qimage(image, (round(image.width * scale), round(image.height * scale)))
         pixmap = QtGui.QPixmap.fromImage(qt_image)
         self.selected_image_label.setPixmap(
             pixmap.scaled(self.selected_image_label.size(), QtCore.Qt.KeepAspectRatioByExpanding, QtCore.Qt.SmoothTransformation))
@@ -285,20 +500,82 @@ class ImageWatermarkApp(QtWidgets.QWidget):
                                   'critical')
             return
 
-        for image_path in images_paths:
-            base_name = os.path.basename(image_path)
-            name, ext = os.path.splitext(base_name)
-            output_path = os.path.join(output_dir, f"{name}_watermark{ext}")
-            
-            manufacturer = get_manufacturer(image_path)
-            if manufacturer is not None:
-                logo_path = find_logo(manufacturer)
-            res = add_borders_logo_and_text(image_path, logo_path, output_path)
-            if res is None:
-                return
-        self.show_message_box(self.translations[self.current_language]['success_title'], 
-                              self.translations[self.current_language]['success'], 
-                              'information')
+        jobs = build_jobs(images_paths, logo_path, output_dir, profile=self.profile_combo.currentText(),
+                          layout=self.layout_combo.currentText(), renditions=self.renditions_combo.currentText())
+        self.progress_bar.setRange(0, len(jobs))
+        self.progress_bar.setValue(0)
+        self.run_button.setEnabled(False)
+        self.cancel_button.setEnabled(True)
+
+        # 批处理在后台线程中进行, 界面保持响应
+        self.batch_thread = QtCore.QThread(self)
+        self.batch_worker = BatchWorker(jobs, self.workers_spin.value(), output_dir, self.force_check.isChecked())
+        self.batch_worker.moveToThread(self.batch_thread)
+        self.batch_thread.started.connect(self.batch_worker.run)
+        self.batch_worker.progress.connect(self.on_batch_progress)
+        self.batch_worker.failed.connect(self.on_batch_failed)
+        self.batch_worker.finished.connect(self.on_batch_finished)
+        self.batch_worker.finished.connect(self.batch_thread.quit)
+        self.batch_thread.start()
+
+    def write_job_log(self, results):
+        """把每张图的耗时记录追加到 JOB_LOG_PATH 的 JSON Lines 日志, 并记录汇总"""
+        records = [result.record for result in results if result.record is not None]
+        if not records:
+            return
+        summary = summarize_records([record for record in records if record['status'] == 'ok'])
+        try:
+            with JobLog(JOB_LOG_PATH) as job_log:
+                for record in records:
+                    job_log.write(record)
+                job_log.write({'summary': summary})
+        except OSError as e:
+            logger.warning("Error writing job log: %s", e)
+        logger.info("%s", format_summary(summary))
+
+    def cancel_run(self):
+        if self.batch_worker is not None:
+            self.batch_worker.cancel()
+            self.cancel_button.setEnabled(False)
+
+    def on_batch_progress(self, done, total, image_path):
+        # 跳过未改变的图像后 total 可能小于任务数
+        self.progress_bar.setMaximum(total)
+        self.progress_bar.setValue(done)
+        self.progress_bar.setFormat(f"%v/%m  {os.path.basename(image_path)}")
+
+    def on_batch_failed(self, error):
+        # failed 先于 finished 发出, 错误在 on_batch_finished 中显示
+        self.batch_error = error
+
+    def on_batch_finished(self, results, skipped):
+        self.run_button.setEnabled(True)
+        self.cancel_button.setEnabled(False)
+        self.batch_worker = None
+
+        translations = self.translations[self.current_language]
+        error, self.batch_error = self.batch_error, None
+        if error is not None:
+            self.show_message_box(translations['error_title'], translations['batch_error'].format(error=error),
+                                  'critical')
+            return
+
+        failed = [result for result in results if result.error is not None]
+        cancelled = [result for result in results if result.cancelled]
+        for result in failed:
+            logger.warning("Error rendering %s: %s", result.image_path, result.error)
+        self.write_job_log(results)
+
+        skipped_text = '\n' + translations['skipped_summary'].format(skipped=skipped) if skipped else ''
+        if not failed and not cancelled:
+            self.show_message_box(translations['success_title'], translations['success'] + skipped_text,
+                                  'information')
+            return
+        text = translations['batch_summary'].format(done=len(results) - len(failed) - len(cancelled),
+                                                    failed=len(failed), cancelled=len(cancelled)) + skipped_text
+        if failed:
+            text += '\n' + '\n'.join(os.path.basename(result.image_path) for result in failed[:10])
+        self.show_message_box(translations['batch_summary_title'], text, 'warning')
 
     def preview(self):
         images_paths = self.images_path_edit.text().split(';')
@@ -311,18 +588,34 @@ class ImageWatermarkApp(QtWidgets.QWidget):
             return
 
         preview_image_path = images_paths[0]
-        preview_image = add_borders_logo_and_text(preview_image_path, logo_path, preview=True)
-        if preview_image is not None:
-            self.display_preview(preview_image)
+        try:
+            preview_image = render_preview(preview_image_path, logo_path,
+                                           (self.preview_area.width(), self.preview_area.height()),
+                                           self.layout_combo.currentText())
+        except WatermarkError as e:
+            self.show_render_error(preview_image_path, e)
+            return
+        self.display_preview(preview_image)
+
+    def show_render_error(self, image_path, error):
+        """把渲染模块抛出的 WatermarkError 显示为对应的错误提示"""
+        logger.warning("Error rendering %s: %s", image_path, error)
+        self.show_message_box(self.translations[self.current_language][error.title_key],
+                              self.translations[self.current_language][error.message_key],
+                              'critical')
 
     def display_preview(self, image):
-        qt_image = pil_image_to_qimage(image)
+        qt_image = pil_image_to_qimage(image, (self.preview_area.width(), self.preview_area.height()))
         pixmap = QtGui.QPixmap.fromImage(qt_image)
         self.preview_area.setPixmap(pixmap.scaled(self.preview_area.size(), QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation))
 
-    def display_exif_info(self, image_path):
+    def display_exif_info(self, image_path, metadata=None):
+        """:param metadata: 缩略图缓存中的 ImageMetadata, 有时不再读取文件"""
         try:
-            focal_length, aperture, exposure_time, iso = get_exif_table(image_path)
+            if metadata is not None:
+                focal_length, aperture, exposure_time, iso = exif_table(metadata)
+            else:
+                focal_length, aperture, exposure_time, iso = get_exif_table(image_path)
             self.exif_info_table.setItem(0, 0, QTableWidgetItem(f"{focal_length:.1f} mm"))
             self.exif_info_table.setItem(0, 1, QTableWidgetItem(f"f/{aperture:.1f}"))
             self.exif_info_table.setItem(0, 2, QTableWidgetItem(f"1/{int(1 / exposure_time)} s"))
@@ -339,78 +632,9 @@ class ImageWatermarkApp(QtWidgets.QWidget):
                                   'critical')
             return None
 
-def add_borders_logo_and_text(image_path, logo_path, output_path = None, preview = False):
-    # Todo: Add more selections
-    image = Image.open(image_path)
-    image = reset_image_orientation(image)  # Reset orientation
-    exif_dict = None
-    exif_bytes = None
-    app_instance = ImageWatermarkApp()
-    
-    try:
-        exif_dict = piexif.load(image.info.get('exif', b''))
-        exif_bytes = piexif.dump(exif_dict)
-    except Exception as e:
-        app_instance.show_message_box(
-                              app_instance.translations[app_instance.current_language]['error_title'], 
-                              app_instance.translations[app_instance.current_language]['exif_error'],
-                              'critical')
-        return None
-
-    result = get_exif_data(image_path)
-    if result is not None:
-        camera_info, shooting_info = result
-
-    border_size = EDGE_WIDTH
-    border_size_side = EDGE_WIDTH_SIDE
-    new_width = image.width + border_size_side * 2
-    new_height = image.height + border_size * 2
-
-    new_image = Image.new("RGB", (new_width, new_height), (255, 255, 255))
-    new_image.paste(image, (border_size_side, int(border_size / 2)))
-
-    logo = Image.open(logo_path).convert("RGBA")
-    logo_width, logo_height = logo.size
-    logo_resize_factor = 200 / logo_height
-    logo = logo.resize((int(logo_width * logo_resize_factor), int(logo_height * logo_resize_factor)), Image.LANCZOS)
-
-    draw = ImageDraw.Draw(new_image)
-
-    font_bold = ImageFont.truetype(GLOBAL_FONT_PATH_BOLD, 100)
-    font_light = ImageFont.truetype(GLOBAL_FONT_PATH_LIGHT, 100)
-
-    camera_info_lines = camera_info.split('\n')
-    shooting_info_lines = shooting_info.split('\n')
-
-    shooting_info_bbox = draw.textbbox((0, 0), shooting_info, font=font_bold)
-
-    text_y = new_height - 1.5 * border_size + 120
-    draw.text((border_size, text_y), camera_info_lines[0], font=font_bold, fill=(0, 0, 0))
-    draw.text((border_size, text_y + 120), camera_info_lines[1], font=font_light, fill=(0, 0, 0))
-
-    shooting_info_width = shooting_info_bbox[2] - shooting_info_bbox[0]
-    draw.text((new_width - border_size - shooting_info_width, text_y), shooting_info_lines[0], font=font_bold, fill=(0, 0, 0))
-    draw.text((new_width - border_size - shooting_info_width, text_y + 120), shooting_info_lines[1], font=font_light, fill=(0, 0, 0))
-
-    new_image.paste(logo,
-                    (new_width - border_size - shooting_info_width - logo.size[0] - 200,
-                     int(new_height - 1.5 * border_size + 80 + int(logo.size[1] / 4))),
-                    logo)
-
-    draw.line((new_width - border_size - shooting_info_width - 100,
-               int(new_height - 1.5 * border_size + 80 + int(logo.size[1] / 4) - 10),
-               new_width - border_size - shooting_info_width - 100,
-               int(new_height - 1.5 * border_size + 80 + int(logo.size[1] / 4) + 10 + logo.size[1])),
-              fill=(0, 0, 0),
-              width=2)
-
-    if preview:
-        return new_image
-    else:
-        new_image.save(output_path, exif=exif_bytes)  # 保留exif数据
-
 if __name__ == '__main__':
     import sys
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
     app = QtWidgets.QApplication(sys.argv)
     ex = ImageWatermarkApp()
     ex.show()
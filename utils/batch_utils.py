@@ -0,0 +1,470 @@
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import nullcontext
+from dataclasses import dataclass
+from PIL import Image
+import multiprocessing
+import io
+import glob
+import time
+import os
+
+from utils.exif_utils import find_logo_for_metadata
+from utils.render_utils import add_borders_logo_and_text, load_metadata, OutputError, WatermarkError
+from utils.encode_utils import DEFAULT_PROFILE, DEFAULT_RENDITIONS, DEFAULT_SUFFIX, get_output_profile, \
+    get_rendition_set
+from utils.layout_utils import DEFAULT_LAYOUT
+from utils.trace_utils import JobTrace
+from utils.manifest_utils import OutputManifest
+from utils.io_utils import PREFETCH_DEPTH, WRITER_THREADS, Prefetcher, WriteBehind
+
+# 批量处理模块, 不依赖 PyQt5; GUI 通过回调获取进度
+
+
+@dataclass
+class BatchJob:
+    image_path: str
+    logo_path: str
+    output_path: str
+    auto_logo: bool = True  # 根据相机厂商自动查找 logo, 找不到时使用 logo_path
+    profile: str = DEFAULT_PROFILE  # configs/output_profiles.json 中的输出配置名
+    layout: str = DEFAULT_LAYOUT  # configs/layouts.json 中的布局模板名
+    renditions: tuple = ()  # 同一次解码派生的其它输出 ((output_path, profile), ...)
+    pixels: int = None  # 文件头中的像素数, 第一次按预算提交时读取
+
+    @property
+    def output_paths(self):
+        return [self.output_path] + [output_path for output_path, _ in self.renditions]
+
+
+@dataclass
+class JobResult:
+    image_path: str
+    output_path: str = None
+    error: str = None
+    error_key: str = None  # configs/i18n.json 中的提示文本
+    elapsed: float = 0.0
+    peak_bytes: int = 0  # 渲染时同时存在的全尺寸位图的峰值内存
+    cancelled: bool = False
+    record: dict = None  # JobTrace.to_record() 的结果, 可写入 JSON Lines 日志
+    encoded: tuple = None  # 交给写入线程保存的编码结果 ((output_path, data), ...)
+
+    @property
+    def ok(self):
+        return self.error is None and not self.cancelled
+
+
+def default_workers():
+    return max(1, os.cpu_count() or 1)
+
+
+# 一张典型照片的像素数, 也是像素预算的下限, 保证至少可以渲染一张
+IMAGE_SIZE = 6000 * 5000
+# 渲染时每个像素大约占用的内存: 解码图像和画布各 3 字节, 另外留出边框、缩放和编码缓冲
+BYTES_PER_PIXEL = 8
+# 默认预算最多使用可用内存的比例
+MEMORY_FRACTION = 0.6
+
+
+def available_memory():
+    """当前可用的物理内存字节数, 无法获取时返回 None"""
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def default_pixel_budget(workers=None):
+    """由可用内存换算同时渲染的像素数, 无法获取内存时按每个进程一张 IMAGE_SIZE 计算"""
+    memory = available_memory()
+    if memory is None:
+        return IMAGE_SIZE * (workers or default_workers())
+    return max(IMAGE_SIZE, int(memory * MEMORY_FRACTION / BYTES_PER_PIXEL))
+
+
+def image_pixels(image_path, source=None):
+    """
+    只读取文件头得到的像素数, 无法读取时返回 0, 错误留给渲染时报告
+    :param source: 已经读入内存的文件内容
+    """
+    try:
+        with Image.open(io.BytesIO(source) if source is not None else image_path) as image:
+            width, height = image.size
+    except Exception:
+        return 0
+    return width * height
+
+
+class PixelBudget:
+    """
+    按像素数而不是文件数限制同时渲染的图像, 内存占用与像素数成正比
+    超过预算的图像 (例如拼接的全景图) 要等其它图像完成后单独渲染
+    """
+
+    def __init__(self, limit=None, workers=None):
+        self.limit = limit or default_pixel_budget(workers)
+        self.in_flight = 0
+        self.running = 0
+        self.exclusive = False
+
+    def admit(self, pixels):
+        """:return: 是否可以开始渲染, 可以时计入预算"""
+        if self.exclusive:
+            return False
+        if pixels > self.limit:
+            if self.running:
+                return False
+            self.exclusive = True
+        elif self.in_flight + pixels > self.limit:
+            return False
+        self.in_flight += pixels
+        self.running += 1
+        return True
+
+    def release(self, pixels):
+        self.in_flight -= pixels
+        self.running -= 1
+        if self.running == 0:
+            self.exclusive = False
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def is_image_file(path):
+    return os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def collect_images(inputs, recursive=False):
+    """
+    把文件、目录和通配符展开为图像文件列表, 保持输入顺序并去重
+    :param recursive: 是否递归遍历子目录, 通配符中的 ** 也只在此时生效
+    """
+    images = []
+    seen = set()
+
+    def add(path):
+        key = os.path.abspath(path)
+        if key not in seen and is_image_file(path):
+            seen.add(key)
+            images.append(path)
+
+    for item in inputs:
+        if os.path.isdir(item):
+            if recursive:
+                for root, dirs, files in os.walk(item):
+                    dirs.sort()
+                    for file in sorted(files):
+                        add(os.path.join(root, file))
+            else:
+                for file in sorted(os.listdir(item)):
+                    add(os.path.join(item, file))
+        elif glob.has_magic(item):
+            for path in sorted(glob.glob(item, recursive=recursive)):
+                add(path)
+        else:
+            add(item)
+    return images
+
+
+def is_inside(path, directory):
+    """path 是否是 directory 本身或位于其中"""
+    return os.path.join(os.path.abspath(path), '').startswith(os.path.join(os.path.abspath(directory), ''))
+
+
+def skip_outputs(images, output_dir, inputs=()):
+    """
+    去掉以前写出的图像: 清单中记录的输出, 以及输出目录中的文件;
+    输出目录就是 (或包含) 某个输入目录时不能整体排除, 只去掉清单中记录的输出
+    :param inputs: 命令行给出的输入, 用来判断输出目录是否包含输入目录
+    """
+    produced = OutputManifest.load(output_dir).output_paths()
+    covers_input = any(os.path.isdir(item) and is_inside(item, output_dir) for item in inputs)
+    return [path for path in images
+            if os.path.abspath(path) not in produced and (covers_input or not is_inside(path, output_dir))]
+
+
+# 输出文件名模板, 可用字段: {name} 原文件名, {suffix} configs/renditions.json 中的后缀,
+# {ext} 扩展名 (输出配置改变格式时为新格式的扩展名)
+NAME_TEMPLATE = "{name}{suffix}{ext}"
+
+
+def output_path_for(image_path, output_dir, name_template=NAME_TEMPLATE, profile=DEFAULT_PROFILE,
+                    suffix=DEFAULT_SUFFIX):
+    name, ext = os.path.splitext(os.path.basename(image_path))
+    ext = get_output_profile(profile).extension(ext)
+    return os.path.join(output_dir, name_template.format(name=name, suffix=suffix, ext=ext))
+
+
+def build_jobs(images_paths, logo_path, output_dir, auto_logo=True, name_template=NAME_TEMPLATE,
+               profile=DEFAULT_PROFILE, layout=DEFAULT_LAYOUT, renditions=DEFAULT_RENDITIONS):
+    """
+    :param renditions: configs/renditions.json 中的输出组名, 第一项为 output_path, 其余为 BatchJob.renditions;
+                       没有指定输出配置的项使用 profile
+    :raises ValueError: 输出配置或输出组不存在、不受支持, 或多个输出的文件名模板中没有 {suffix} 时
+    """
+    rendition_set = get_rendition_set(renditions)
+    if len(rendition_set.renditions) > 1 and '{suffix}' not in name_template:
+        raise ValueError(f"Rendition set '{rendition_set.name}' writes several files, "
+                         f"the name template needs {{suffix}}")
+    jobs = []
+    for image_path in images_paths:
+        if not image_path:
+            continue
+        outputs = [(output_path_for(image_path, output_dir, name_template, rendition.profile or profile,
+                                    rendition.suffix), rendition.profile or profile)
+                   for rendition in rendition_set.renditions]
+        (output_path, first_profile), others = outputs[0], tuple(outputs[1:])
+        jobs.append(BatchJob(image_path, logo_path, output_path, auto_logo, first_profile, layout, others))
+    return jobs
+
+
+def render_job(job, source=None, write_behind=False):
+    """
+    在工作进程中渲染一张图像, 所有异常都记录到 JobResult 中而不是抛出
+    :param source: 预读的输入文件内容, 为 None 时从 job.image_path 读取
+    :param write_behind: 为 True 时不写入文件, 编码结果放在 JobResult.encoded 中交给写入线程
+    """
+    trace = JobTrace(job.image_path)
+    encoded = []
+    writer = (lambda path, data: encoded.append((path, data))) if write_behind else None
+
+    def result(**fields):
+        record = trace.to_record(output_path=fields.get('output_path'),
+                                 status='ok' if fields.get('error') is None else 'failed',
+                                 error=fields.get('error'))
+        return JobResult(job.image_path, elapsed=record['total'], peak_bytes=record['peak_bytes'],
+                         record=record, **fields)
+
+    try:
+        # EXIF 只解析一次, 查找 logo 和渲染共用; 预读的内容不进入元数据缓存
+        with trace.stage('exif'):
+            metadata = load_metadata(job.image_path, source)
+        logo_path = job.logo_path
+        if job.auto_logo:
+            with trace.stage('logo'):
+                logo_path = find_logo_for_metadata(metadata, job.logo_path)
+        output_path = add_borders_logo_and_text(job.image_path, logo_path, job.output_path, trace=trace,
+                                                profile=job.profile, layout=job.layout, renditions=job.renditions,
+                                                source=source, writer=writer, metadata=metadata)
+        return result(output_path=output_path, encoded=tuple(encoded) or None)
+    except WatermarkError as e:
+        return result(error=str(e), error_key=e.message_key)
+    except Exception as e:
+        return result(error=f"{type(e).__name__}: {e}")
+
+
+def render_pool(workers, initializer=None, initargs=()):
+    """渲染进程池, 使用 spawn 避免在已启动线程 (Qt、预读、写入、HTTP) 的进程中 fork"""
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=initializer, initargs=initargs)
+
+
+def _started(delay):
+    """预热任务: 反序列化时已经导入渲染模块, 稍作等待让每个进程各分到一个"""
+    time.sleep(delay)
+    return os.getpid()
+
+
+class BudgetedPool:
+    """
+    按像素预算向渲染进程池提交任务, 任务完成时释放预算; 批处理和监视模式共用
+    :param initializer: 工作进程启动时调用, 见 render_pool
+    """
+
+    def __init__(self, workers, pixel_budget=None, initializer=None):
+        self.workers = workers
+        self.budget = PixelBudget(pixel_budget, workers)
+        self._executor = render_pool(workers, initializer)
+        self._running = {}
+
+    def start(self):
+        """
+        提前启动全部工作进程并导入渲染模块, 之后提交的任务不再承担进程启动的开销
+        :return: 已启动的工作进程数
+        """
+        futures = [self._executor.submit(_started, 0.1) for _ in range(self.workers)]
+        return len({future.result() for future in futures})
+
+    def __len__(self):
+        return len(self._running)
+
+    def submit(self, job, key=None, source=None, write_behind=False):
+        """
+        :param key: 完成时随结果返回, 默认为 job
+        :param source: 已经读入内存的文件内容
+        :return: 预算不足时返回 False, 任务未提交
+        """
+        if job.pixels is None:
+            # 缓存在任务上, 预算不足反复重试时不再读取文件头
+            job.pixels = image_pixels(job.image_path, source)
+        if not self.budget.admit(job.pixels):
+            return False
+        future = self._executor.submit(render_job, job, source, write_behind)
+        self._running[future] = (job, job if key is None else key)
+        return True
+
+    def completed(self, timeout=None):
+        """
+        等待至少一个任务完成, 最多 timeout 秒; timeout 为 None 时等待全部任务
+        :return: [(key, JobResult), ...], 工作进程异常退出时 JobResult 带有错误信息
+        """
+        if not self._running:
+            return []
+        if timeout is None:
+            finished, _ = wait(self._running)
+        else:
+            finished, _ = wait(self._running, timeout=timeout, return_when=FIRST_COMPLETED)
+        results = []
+        for future in finished:
+            job, key = self._running.pop(future)
+            self.budget.release(job.pixels)
+            try:
+                result = future.result()
+            except Exception as e:
+                # 工作进程异常退出等情况
+                result = JobResult(job.image_path, error=f"{type(e).__name__}: {e}")
+            results.append((key, result))
+        return results
+
+    def close(self, cancel=False):
+        """:param cancel: 取消尚未开始的任务"""
+        self._executor.shutdown(wait=True, cancel_futures=cancel)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def run_batch(jobs, workers=None, on_result=None, cancel_event=None, pixel_budget=None, prefetch=PREFETCH_DEPTH,
+              writers=WRITER_THREADS, pool=None):
+    """
+    渲染一批图像, 单张失败不会中断整个批次
+    :param workers: 进程数, 为 1 时在当前进程中顺序执行
+    :param pixel_budget: 同时渲染的最大像素数, 默认由可用内存换算; 超过预算的图像单独渲染
+    :param prefetch: 后台线程预读的输入文件数, 为 0 时由渲染进程自己读取
+    :param writers: 保存输出的后台线程数, 为 0 时由渲染进程自己写入
+    :param on_result: 每完成一张调用 on_result(done, total, result), 输出文件此时已经写完
+    :param cancel_event: threading.Event, 置位后不再提交新任务, 未开始的任务标记为已取消
+    :param pool: 复用已经启动的 BudgetedPool, 此时忽略 pixel_budget, 结束后不关闭
+    :return: 与 jobs 顺序一致的 JobResult 列表
+    """
+    jobs = list(jobs)
+    total = len(jobs)
+    workers = min(workers or default_workers(), max(total, 1))
+    results = [None] * total
+    done = 0
+    # 读写与渲染重叠: 预读线程按顺序读入输入文件, 渲染结果交给写入线程保存
+    reader = Prefetcher([job.image_path for job in jobs], prefetch) if prefetch > 0 and total else None
+    writer = WriteBehind(writers) if writers > 0 else None
+    write_behind = writer is not None
+
+    def record(index, result):
+        nonlocal done
+        results[index] = result
+        done += 1
+        if on_result is not None:
+            on_result(done, total, result)
+
+    def finish(index, result):
+        if write_behind and result.encoded:
+            encoded, result.encoded = result.encoded, None
+            writer.submit(encoded, (index, result))
+        else:
+            record(index, result)
+        collect_writes()
+
+    def collect_writes(block=False):
+        if not write_behind:
+            return
+        for (index, result), seconds, error in writer.completed(block):
+            if error is not None:
+                result.error = f"Cannot save '{result.output_path}': {error}"
+                result.error_key = OutputError.message_key
+                result.output_path = None
+            if result.record is not None:
+                result.record['stages']['write'] = seconds or 0.0
+                if error is not None:
+                    result.record.update(status='failed', error=result.error, output_path=None)
+            record(index, result)
+
+    def next_source():
+        return reader.get()[1] if reader is not None else None
+
+    def cancelled():
+        return cancel_event is not None and cancel_event.is_set()
+
+    try:
+        if workers == 1:
+            for index, job in enumerate(jobs):
+                if cancelled():
+                    break
+                finish(index, render_job(job, next_source(), write_behind))
+        else:
+            with BudgetedPool(workers, pixel_budget) if pool is None else nullcontext(pool) as pool:
+                sources = {}
+                next_index = 0
+                # 只保持少量任务在队列中, 取消时可以尽快停止; 按顺序提交, 预算不足时等待已提交的任务完成
+                while next_index < total or pool:
+                    while next_index < total and len(pool) < workers * 2 and not cancelled():
+                        if next_index not in sources:
+                            # 预读尚未完成时先处理已经完成的任务
+                            if reader is not None and pool and not reader.ready():
+                                break
+                            sources[next_index] = next_source()
+                        if not pool.submit(jobs[next_index], next_index, sources[next_index], write_behind):
+                            break
+                        del sources[next_index]
+                        next_index += 1
+                    if not pool:
+                        break
+                    for index, result in pool.completed(0.2):
+                        finish(index, result)
+                    collect_writes()
+        # 已经渲染完成的图像即使取消也要写完
+        collect_writes(block=True)
+    finally:
+        if reader is not None:
+            reader.close()
+        if writer is not None:
+            writer.close()
+
+    for index, job in enumerate(jobs):
+        if results[index] is None:
+            results[index] = JobResult(job.image_path, cancelled=True)
+    return results
+
+
+def run_incremental_batch(jobs, output_dir, workers=None, on_result=None, cancel_event=None, force=False,
+                          roots=(), recursive=False, prune=False, **batch_options):
+    """
+    与 run_batch 相同, 但跳过输出目录清单中记录过且输入、logo、字体和输出配置都没有变化的图像,
+    并删除 roots 中输入已不存在的旧输出
+    :param force: 为 True 时忽略清单, 全部重新渲染
+    :param roots: 扫描过的输入目录, recursive 时包括子目录, 见 OutputManifest.prune
+    :param prune: 为 True 时删除清单中所有输入已不存在的旧输出, 不限于 roots
+    :param batch_options: 传给 run_batch 的 pixel_budget, prefetch, writers
+    :return: (results, skipped, pruned), skipped 为跳过的 BatchJob, pruned 为删除的输出路径
+    """
+    manifest = OutputManifest.load(output_dir)
+    pruned = manifest.prune(roots, recursive, force=prune)
+    pending, skipped = manifest.plan(jobs, force)
+
+    def record(done, total, result):
+        manifest.record(result)
+        if on_result is not None:
+            on_result(done, total, result)
+
+    try:
+        results = run_batch(pending, workers, on_result=record, cancel_event=cancel_event, **batch_options)
+    finally:
+        manifest.save()
+    return results, skipped, pruned
@@ -0,0 +1,316 @@
+from dataclasses import dataclass, fields
+import sqlite3
+import json
+import struct
+import time
+import os
+import logging
+
+from utils.exif_utils import ImageMetadata, find_logo, manufacturer_name
+from utils.batch_utils import build_jobs, collect_images
+
+# 持久化的元数据目录, 扫描时每个 JPEG 只读取文件头到 EXIF (APP1) 和尺寸 (SOF) 段为止
+
+logger = logging.getLogger(__name__)
+
+CATALOG_PATH = os.path.join(os.path.expanduser('~'), '.autowatermark', 'catalog.sqlite')
+CATALOG_VERSION = 1
+
+# 带图像尺寸的 SOF 段, 不包括 DHT (C4)、JPG (C8) 和 DAC (CC)
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# 可以用于 filter 和 group_by 的列
+FILTER_COLUMNS = ('directory', 'make', 'model', 'lens', 'focal_length', 'aperture', 'exposure_time', 'iso',
+                  'orientation', 'logo_path')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    orientation INTEGER,
+    make TEXT,
+    model TEXT,
+    lens TEXT,
+    focal_length INTEGER,
+    aperture REAL,
+    exposure_time REAL,
+    iso INTEGER,
+    datetime TEXT,
+    has_exif INTEGER NOT NULL DEFAULT 0,
+    logo_path TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS images_directory ON images (directory);
+CREATE INDEX IF NOT EXISTS images_camera ON images (make, model);
+CREATE INDEX IF NOT EXISTS images_lens ON images (lens);
+"""
+
+
+def read_jpeg_header(image_path):
+    """
+    顺序读取 JPEG 的标记段, 遇到图像数据 (SOS) 之前停止, 只读取 APP1 和 SOF 的内容
+    :return: (宽, 高, EXIF 原始字节或 None); 不是 JPEG 时返回 None
+    :raises ValueError: 文件头损坏时
+    """
+    exif_bytes = None
+    size = None
+    with open(image_path, 'rb') as f:
+        if f.read(2) != b'\xff\xd8':
+            return None
+        while True:
+            prefix = f.read(1)
+            if prefix != b'\xff':
+                raise ValueError(f"Corrupt JPEG header in '{image_path}'")
+            marker = f.read(1)
+            while marker == b'\xff':  # 填充字节
+                marker = f.read(1)
+            if not marker:
+                raise ValueError(f"Truncated JPEG header in '{image_path}'")
+            code = marker[0]
+            if code == 0x01 or 0xD0 <= code <= 0xD8:
+                continue  # 没有长度字段的标记
+            if code in (0xD9, 0xDA):
+                break
+            length_bytes = f.read(2)
+            if len(length_bytes) != 2:
+                raise ValueError(f"Truncated JPEG header in '{image_path}'")
+            length = struct.unpack('>H', length_bytes)[0] - 2
+            if code == 0xE1 and exif_bytes is None:
+                data = f.read(length)
+                if data.startswith(b'Exif\x00\x00'):
+                    exif_bytes = data
+            elif code in SOF_MARKERS:
+                data = f.read(length)
+                height, width = struct.unpack('>HH', data[1:5])
+                size = (width, height)
+            else:
+                f.seek(length, os.SEEK_CUR)
+            if size is not None and exif_bytes is not None:
+                break
+    if size is None:
+        raise ValueError(f"No frame header in '{image_path}'")
+    return size[0], size[1], exif_bytes
+
+
+def read_header_metadata(image_path):
+    """JPEG 只读取文件头中的 EXIF 和尺寸, 其它格式交给 Pillow (同样不解码像素)"""
+    header = read_jpeg_header(image_path)
+    if header is None:
+        return ImageMetadata.from_file(image_path)
+    width, height, exif_bytes = header
+    return ImageMetadata.from_exif(image_path, width, height, exif_bytes)
+
+
+@dataclass
+class CatalogEntry:
+    path: str
+    directory: str
+    size: int
+    mtime_ns: int
+    width: int = None
+    height: int = None
+    orientation: int = None
+    make: str = None
+    model: str = None
+    lens: str = None
+    focal_length: int = None
+    aperture: float = None
+    exposure_time: float = None
+    iso: int = None
+    datetime: str = None
+    has_exif: bool = False
+    logo_path: str = None
+    error: str = None  # 无法读取时的错误信息
+
+    @property
+    def camera(self):
+        return " ".join(filter(None, (self.make, self.model))) or None
+
+
+CATALOG_COLUMNS = tuple(field.name for field in fields(CatalogEntry))
+
+
+def catalog_entry(image_path, stat):
+    """读取一个文件的元数据, 失败时把错误记录在条目中"""
+    path = os.path.abspath(image_path)
+    entry = CatalogEntry(path=path, directory=os.path.dirname(path), size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+    try:
+        metadata = read_header_metadata(image_path)
+    except Exception as e:
+        entry.error = f"{type(e).__name__}: {e}"
+        return entry
+    entry.width, entry.height, entry.orientation = metadata.width, metadata.height, metadata.orientation
+    entry.make, entry.model, entry.lens = metadata.make, metadata.model, metadata.lens
+    entry.focal_length, entry.aperture = metadata.focal_length, metadata.aperture
+    entry.exposure_time, entry.iso, entry.datetime = metadata.exposure_time, metadata.iso, metadata.datetime
+    entry.has_exif = metadata.exif_dict is not None
+    manufacturer = manufacturer_name(metadata)
+    entry.logo_path = find_logo(manufacturer) if manufacturer else None
+    return entry
+
+
+class Catalog:
+    """
+    SQLite 元数据目录, 以文件绝对路径为主键, 按 (大小, mtime) 判断文件是否变化
+    同一个 Catalog 对象只能在创建它的线程中使用
+    """
+
+    def __init__(self, path=CATALOG_PATH):
+        self.path = path
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version not in (0, CATALOG_VERSION):
+            # 旧版本的目录只是缓存, 直接重建
+            self.connection.execute("DROP TABLE IF EXISTS images")
+        self.connection.executescript(SCHEMA)
+        self.connection.execute(f"PRAGMA user_version = {CATALOG_VERSION}")
+        self.connection.commit()
+
+    def scan(self, inputs, recursive=False, on_progress=None, batch_size=500):
+        """
+        把文件、目录和通配符中的图像加入目录, 只重新读取新增或 (大小, mtime) 变化的文件,
+        并删除扫描过的目录中已经不存在的文件
+        :param on_progress: 每写入一批调用 on_progress(done, total)
+        :return: {'scanned', 'updated', 'unchanged', 'removed', 'seconds'}
+        """
+        start = time.perf_counter()
+        images = [os.path.abspath(path) for path in collect_images(inputs, recursive)]
+        directories = sorted({os.path.abspath(item) for item in inputs if os.path.isdir(item)})
+        known = {}
+        for directory in directories:
+            prefix = directory.rstrip(os.sep) + os.sep
+            for row in self.connection.execute(
+                    "SELECT path, size, mtime_ns FROM images WHERE directory = ? OR substr(directory, 1, ?) = ?",
+                    (directory, len(prefix), prefix)):
+                known[row['path']] = (row['size'], row['mtime_ns'])
+        for path in images:
+            if path not in known:
+                row = self.connection.execute("SELECT size, mtime_ns FROM images WHERE path = ?", (path,)).fetchone()
+                if row is not None:
+                    known[path] = (row['size'], row['mtime_ns'])
+
+        updated = 0
+        unchanged = 0
+        batch = []
+        placeholders = ', '.join('?' for _ in CATALOG_COLUMNS)
+        insert = f"INSERT OR REPLACE INTO images ({', '.join(CATALOG_COLUMNS)}) VALUES ({placeholders})"
+
+        def flush():
+            with self.connection:
+                self.connection.executemany(insert, batch)
+            batch.clear()
+
+        for index, path in enumerate(images):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if known.get(path) == (stat.st_size, stat.st_mtime_ns):
+                unchanged += 1
+                continue
+            entry = catalog_entry(path, stat)
+            batch.append(tuple(getattr(entry, column) for column in CATALOG_COLUMNS))
+            updated += 1
+            if len(batch) >= batch_size:
+                flush()
+                if on_progress is not None:
+                    on_progress(index + 1, len(images))
+        if batch:
+            flush()
+
+        # 只删除这次扫描覆盖的目录中消失的文件
+        scanned = set(images)
+        removed = [path for path in known
+                   if path not in scanned and (recursive or os.path.dirname(path) in directories)]
+        if removed:
+            with self.connection:
+                self.connection.executemany("DELETE FROM images WHERE path = ?", [(path,) for path in removed])
+        if on_progress is not None:
+            on_progress(len(images), len(images))
+        return {'scanned': len(images), 'updated': updated, 'unchanged': unchanged, 'removed': len(removed),
+                'seconds': time.perf_counter() - start}
+
+    def _where(self, filters, paths=None):
+        clauses, values = [], []
+        for column, value in filters.items():
+            if column not in FILTER_COLUMNS:
+                raise ValueError(f"Cannot filter on '{column}', available: {', '.join(FILTER_COLUMNS)}")
+            if value is None:
+                continue
+            if isinstance(value, str) and any(letter in value for letter in '*?'):
+                clauses.append(f"{column} GLOB ?")
+            elif isinstance(value, str):
+                clauses.append(f"{column} = ? COLLATE NOCASE")
+            else:
+                clauses.append(f"{column} = ?")
+            values.append(value)
+        if paths is not None:
+            clauses.append("path IN (SELECT value FROM json_each(?))")
+            values.append(json.dumps([os.path.abspath(path) for path in paths]))
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", values
+
+    def query(self, paths=None, **filters):
+        """
+        按列过滤, 字符串支持 * 和 ? 通配符, 例如 query(make='SONY', lens='FE 24-70*')
+        :param paths: 只在这些文件中查找
+        :return: 按路径排序的 CatalogEntry 列表
+        """
+        where, values = self._where(filters, paths)
+        rows = self.connection.execute(f"SELECT * FROM images{where} ORDER BY path", values)
+        return [CatalogEntry(**dict(row)) for row in rows]
+
+    def group_by(self, column, paths=None, **filters):
+        """:return: [(取值, 数量), ...], 数量多的在前"""
+        if column not in FILTER_COLUMNS:
+            raise ValueError(f"Cannot group by '{column}', available: {', '.join(FILTER_COLUMNS)}")
+        where, values = self._where(filters, paths)
+        rows = self.connection.execute(
+            f"SELECT {column} AS value, COUNT(*) AS count FROM images{where} GROUP BY {column} "
+            f"ORDER BY count DESC, value", values)
+        return [(row['value'], row['count']) for row in rows]
+
+    def get(self, image_path):
+        """:return: 与文件当前 (大小, mtime) 一致的 CatalogEntry, 不存在或已过期时返回 None"""
+        path = os.path.abspath(image_path)
+        row = self.connection.execute("SELECT * FROM images WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if (row['size'], row['mtime_ns']) != (stat.st_size, stat.st_mtime_ns):
+            return None
+        return CatalogEntry(**dict(row))
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+
+def build_catalog_jobs(entries, logo_path, output_dir, **job_options):
+    """
+    由目录条目生成 BatchJob, logo 直接使用目录中记录的结果, 工作进程不再查找
+    读取失败的条目被跳过
+    :param job_options: 传给 build_jobs 的 name_template, profile, layout, renditions
+    """
+    jobs = []
+    for entry in entries:
+        if entry.error is None:
+            jobs.extend(build_jobs([entry.path], entry.logo_path or logo_path, output_dir, auto_logo=False,
+                                   **job_options))
+    return jobs
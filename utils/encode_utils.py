@@ -0,0 +1,198 @@
+from PIL import Image
+from dataclasses import dataclass, field
+from functools import lru_cache
+import json
+import time
+import io
+import os
+
+OUTPUT_PROFILES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                    "configs", "output_profiles.json")
+
+RENDITIONS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                               "configs", "renditions.json")
+
+DEFAULT_PROFILE = "original"
+DEFAULT_RENDITIONS = "single"
+DEFAULT_SUFFIX = "_watermark"
+
+FORMAT_EXTENSIONS = {
+    'JPEG': '.jpg',
+    'WEBP': '.webp',
+    'AVIF': '.avif',
+    'PNG': '.png',
+}
+
+
+@dataclass(frozen=True)
+class OutputProfile:
+    """
+    保存阶段的编码设置, 定义在 configs/output_profiles.json 中
+    format 为 None 时沿用输入文件的格式和 Pillow 默认参数
+    """
+    name: str
+    format: str = None
+    max_long_edge: int = None
+    options: dict = field(default_factory=dict)
+    description: str = ''
+
+    def is_supported(self):
+        if self.format is None:
+            return True
+        Image.init()
+        return self.format in Image.SAVE
+
+    def extension(self, source_ext):
+        if self.format is None:
+            return source_ext
+        return FORMAT_EXTENSIONS.get(self.format, source_ext)
+
+
+@dataclass(frozen=True)
+class Rendition:
+    """
+    一次渲染输出的一个文件, 定义在 configs/renditions.json 中
+    profile 为 None 时使用任务选择的输出配置
+    """
+    suffix: str = DEFAULT_SUFFIX
+    profile: str = None
+
+
+@dataclass(frozen=True)
+class RenditionSet:
+    name: str
+    renditions: tuple = (Rendition(),)
+    description: str = ''
+
+
+@lru_cache(maxsize=None)
+def load_output_profiles(path=OUTPUT_PROFILES_PATH):
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    return {name: OutputProfile(name=name, **settings) for name, settings in config.items()}
+
+
+def available_profiles():
+    """当前 Pillow 支持的输出配置名, 例如没有 AVIF 编码器时不包含 avif"""
+    return [name for name, profile in load_output_profiles().items() if profile.is_supported()]
+
+
+def get_output_profile(name=None):
+    """
+    :raises ValueError: 配置不存在或当前 Pillow 不支持该格式时
+    """
+    profiles = load_output_profiles()
+    profile = profiles.get(name or DEFAULT_PROFILE)
+    if profile is None:
+        raise ValueError(f"Unknown output profile '{name}', available: {', '.join(profiles)}")
+    if not profile.is_supported():
+        raise ValueError(f"Output profile '{name}' needs {profile.format} support, which this Pillow build lacks")
+    return profile
+
+
+@lru_cache(maxsize=None)
+def load_rendition_sets(path=RENDITIONS_PATH):
+    """:raises ValueError: 同一组中有重复的文件名后缀时"""
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    sets = {}
+    for name, settings in config.items():
+        settings = dict(settings)
+        renditions = tuple(Rendition(**rendition) for rendition in settings.pop('renditions'))
+        suffixes = [rendition.suffix for rendition in renditions]
+        if not renditions or len(set(suffixes)) != len(suffixes):
+            raise ValueError(f"Rendition set '{name}' needs at least one rendition and distinct suffixes")
+        sets[name] = RenditionSet(name=name, renditions=renditions, **settings)
+    return sets
+
+
+def available_rendition_sets():
+    return list(load_rendition_sets())
+
+
+def get_rendition_set(name=None):
+    """
+    :raises ValueError: 组不存在, 或其中的输出配置不存在、不受支持时
+    """
+    sets = load_rendition_sets()
+    rendition_set = sets.get(name or DEFAULT_RENDITIONS)
+    if rendition_set is None:
+        raise ValueError(f"Unknown rendition set '{name}', available: {', '.join(sets)}")
+    for rendition in rendition_set.renditions:
+        if rendition.profile is not None:
+            get_output_profile(rendition.profile)
+    return rendition_set
+
+
+def fitted_size(size, max_long_edge):
+    """长边不超过 max_long_edge 时的尺寸"""
+    width, height = size
+    if not max_long_edge or max(width, height) <= max_long_edge:
+        return width, height
+    factor = max_long_edge / max(width, height)
+    return max(1, round(width * factor)), max(1, round(height * factor))
+
+
+def fit_long_edge(image, max_long_edge):
+    """长边超过 max_long_edge 时按比例缩小, 否则原样返回"""
+    size = fitted_size(image.size, max_long_edge)
+    if size == image.size:
+        return image
+    return image.resize(size, Image.LANCZOS, reducing_gap=3.0)
+
+
+def encode_image(image, fp, profile, exif=None, source_format=None):
+    """
+    按输出配置缩放并编码图像
+    :param fp: 文件路径或可写的文件对象
+    :param source_format: 配置沿用输入格式且 fp 不是路径时使用
+    """
+    image = fit_long_edge(image, profile.max_long_edge)
+    image_format = profile.format or (source_format if not isinstance(fp, (str, os.PathLike)) else None)
+    options = dict(profile.options)
+    if exif:
+        options['exif'] = exif
+    image.save(fp, format=image_format, **options)
+
+
+def encode_renditions(image, outputs, exif=None, source_format=None):
+    """
+    把同一张合成好的图像编码为多个文件, 从大到小依次缩小, 每一级都由上一级缩小得到,
+    不需要每个尺寸都从全尺寸图像重新缩放
+    :param outputs: [(fp, OutputProfile), ...]
+    """
+    outputs = sorted(outputs, key=lambda output: fitted_size(image.size, output[1].max_long_edge),
+                     reverse=True)
+    current = image
+    for fp, profile in outputs:
+        size = fitted_size(image.size, profile.max_long_edge)
+        if size != current.size:
+            resized = current.resize(size, Image.LANCZOS, reducing_gap=3.0)
+            if current is not image:
+                current.close()
+            current = resized
+        encode_image(current, fp, profile, exif, source_format)
+    if current is not image:
+        current.close()
+
+
+def profile_report(image, profile_names=None, exif=None, source_format='JPEG'):
+    """
+    用每个输出配置把 image 编码到内存中, 统计文件大小和耗时
+    :return: [{'profile', 'format', 'size', 'bytes', 'seconds'}, ...]
+    """
+    report = []
+    for name in profile_names or available_profiles():
+        profile = get_output_profile(name)
+        buffer = io.BytesIO()
+        start = time.perf_counter()
+        encode_image(image, buffer, profile, exif, source_format)
+        seconds = time.perf_counter() - start
+        report.append({
+            'profile': name,
+            'format': profile.format or source_format,
+            'size': list(fitted_size(image.size, profile.max_long_edge)),
+            'bytes': buffer.tell(),
+            'seconds': seconds,
+        })
+    return report
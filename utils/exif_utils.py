@@ -1,11 +1,22 @@
 from PIL import Image
+from collections import OrderedDict
+from dataclasses import dataclass
 import piexif
 import subprocess
+import io
+import threading
+import struct
 import os
+import logging
+
+from utils.logo_utils import get_logo_registry
+
+logger = logging.getLogger(__name__)
+
+METADATA_CACHE_SIZE = 256
 
 def convert_to_int(value):
     if isinstance(value, tuple):
-        print("isTuple")
         return int(value[0])
     elif isinstance(value, int):
         # 如果已经是整数，直接返回
@@ -19,113 +30,228 @@ def convert_to_int(value):
     else:
         # 其他类型可以选择抛出异常或处理
         raise ValueError("Unsupported type")
-    
-def get_manufacturer(image_path):
+
+def keep_characters(text, allowed):
+    return ''.join(letter for letter in text if letter in allowed)
+
+def rational_to_float(value):
+    return value[0] / value[1] if value[1] != 0 else 0
+
+@dataclass(frozen=True)
+class ImageMetadata:
+    """
+    单个文件解析一次得到的元数据, 其它 EXIF 辅助函数都从这里读取
+    没有 EXIF 的文件 exif_dict 和 exif_bytes 为 None
+    """
+    path: str
+    width: int
+    height: int
+    exif_bytes: bytes = None
+    exif_dict: dict = None
+    make: str = None
+    model: str = None
+    lens: str = None
+    focal_length: int = None  # 35mm 等效焦距, 缺失时退回实际焦距
+    aperture: float = None
+    exposure_time: float = None
+    iso: int = None
+    datetime: str = None
+    orientation: int = 1
+
+    @classmethod
+    def from_file(cls, image_path, source=None):
+        """:param source: 已经读入内存的文件内容, 给出时不再读取 image_path"""
+        # Image.open 只读取文件头, 不会解码像素
+        with Image.open(io.BytesIO(source) if source is not None else image_path) as image:
+            width, height = image.size
+            exif_bytes = image.info.get('exif')
+        return cls.from_exif(image_path, width, height, exif_bytes)
+
+    @classmethod
+    def from_exif(cls, image_path, width, height, exif_bytes):
+        """由已经读出的像素尺寸和 EXIF 原始字节构造, exif_bytes 为空时表示没有 EXIF"""
+        if not exif_bytes:
+            return cls(path=image_path, width=width, height=height)
+
+        exif_dict = piexif.load(exif_bytes)
+        zeroth = exif_dict.get('0th', {})
+        exif_data = exif_dict.get('Exif', {})
+
+        make = zeroth.get(piexif.ImageIFD.Make)
+        model = zeroth.get(piexif.ImageIFD.Model)
+        lens = exif_data.get(piexif.ExifIFD.LensModel)
+        datetime = exif_data.get(piexif.ExifIFD.DateTimeOriginal)
+
+        focal_length = exif_data.get(piexif.ExifIFD.FocalLengthIn35mmFilm, (0, 1))
+        #Some photos don't have focal length in 35mm film
+        if focal_length == (0, 1):
+            focal_length = convert_to_int(exif_data.get(piexif.ExifIFD.FocalLength, (0, 1)))
+
+        return cls(
+            path=image_path,
+            width=width,
+            height=height,
+            exif_bytes=exif_bytes,
+            exif_dict=exif_dict,
+            make=make.decode().strip() if make is not None else None,
+            model=model.decode() if model is not None else None,
+            lens=lens.decode() if lens is not None else None,
+            focal_length=focal_length,
+            aperture=rational_to_float(exif_data.get(piexif.ExifIFD.FNumber, (0, 1))),
+            exposure_time=rational_to_float(exif_data.get(piexif.ExifIFD.ExposureTime, (0, 1))),
+            iso=exif_data.get(piexif.ExifIFD.ISOSpeedRatings, 0),
+            datetime=datetime.decode() if datetime is not None else None,
+            orientation=zeroth.get(piexif.ImageIFD.Orientation, 1),
+        )
+
+_metadata_cache = OrderedDict()
+_metadata_cache_lock = threading.Lock()
+
+def get_metadata(image_path, source=None):
+    """
+    读取图像元数据, 按 (路径, mtime, 文件大小) 缓存, 超过 METADATA_CACHE_SIZE 时淘汰最久未使用的条目
+    :param source: 已经读入内存的文件内容, 给出时直接解析, 不访问文件也不缓存
+    :raises OSError: 文件无法打开时
+    """
+    if source is not None:
+        return ImageMetadata.from_file(image_path, source)
+    stat = os.stat(image_path)
+    key = (os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size)
+    with _metadata_cache_lock:
+        metadata = _metadata_cache.get(key)
+        if metadata is not None:
+            _metadata_cache.move_to_end(key)
+            return metadata
+
+    metadata = ImageMetadata.from_file(image_path)
+
+    with _metadata_cache_lock:
+        _metadata_cache[key] = metadata
+        _metadata_cache.move_to_end(key)
+        while len(_metadata_cache) > METADATA_CACHE_SIZE:
+            _metadata_cache.popitem(last=False)
+    return metadata
+
+def clear_metadata_cache():
+    with _metadata_cache_lock:
+        _metadata_cache.clear()
+
+def reset_exif_orientation(exif_bytes):
+    """
+    把 EXIF 中 IFD0 的方向标签改为 1 (正常), 直接修改原始字节, 其余数据保持不变
+    用于已经按方向旋转过像素的输出图像, 避免看图软件再旋转一次
+    """
     try:
-        image = Image.open(image_path)
-        exif_dict = piexif.load(image.info['exif'])
-        manufacturer = exif_dict['0th'].get(piexif.ImageIFD.Make, b"").decode().strip()
-        for letter in manufacturer:
-            if letter in 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ':
-                continue
-            else:
-                manufacturer = manufacturer.replace(letter, '')
-        return manufacturer
-    except KeyError:
+        data = bytearray(exif_bytes)
+        start = 6 if data[:6] == b'Exif\x00\x00' else 0
+        byte_order = bytes(data[start:start + 2])
+        if byte_order not in (b'II', b'MM'):
+            return exif_bytes
+        endian = '<' if byte_order == b'II' else '>'
+        ifd = start + struct.unpack_from(endian + 'I', data, start + 4)[0]
+        entries = struct.unpack_from(endian + 'H', data, ifd)[0]
+        for i in range(entries):
+            entry = ifd + 2 + i * 12
+            tag, value_type = struct.unpack_from(endian + 'HH', data, entry)
+            if tag == piexif.ImageIFD.Orientation and value_type == 3:
+                struct.pack_into(endian + 'H', data, entry + 8, 1)
+                return bytes(data)
+    except struct.error as e:
+        logger.warning("Error resetting EXIF orientation: %s", e)
+    return exif_bytes
+
+def get_output_exif(metadata):
+    """输出图像使用的 EXIF: 像素已经转正时把方向标签重置为 1"""
+    if metadata.exif_bytes is None or metadata.orientation in (None, 1):
+        return metadata.exif_bytes
+    return reset_exif_orientation(metadata.exif_bytes)
+
+def manufacturer_name(metadata):
+    """查找 logo 用的厂商名, 只保留字母; 没有 EXIF 时返回 None"""
+    if metadata.exif_dict is None:
         return None
+    return keep_characters(metadata.make or '', 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ')
+
+def get_manufacturer(image_path, source=None):
+    try:
+        return manufacturer_name(get_metadata(image_path, source))
     except Exception as e:
-        print(f"Error getting manufacturer: {e}")
+        logger.warning("Error getting manufacturer: %s", e)
         return None
 
-def find_logo(manufacturer):
-    logo_dir = "./logos"
-    if not os.path.isdir(logo_dir):
-        logo_dir = "D:/摄影/tool/auto_watermark/logos"  # 替换为你的logo文件夹路径
-    for root, dirs, files in os.walk(logo_dir):
-        for file in files:
-            if file.lower().startswith(manufacturer.lower().split()[0]) \
-                    or manufacturer.lower().startswith(file.lower().split('.')[0]):
-                return os.path.join(root, file)
-    return None
+def find_logo(manufacturer, variant=''):
+    return get_logo_registry().find(manufacturer, variant)
 
-def get_exif_table(image_path):
-    try:
-        image = Image.open(image_path)
-        exif_dict = piexif.load(image.info['exif'])
-        exif_data = exif_dict['Exif']
+def find_logo_for_image(image_path, fallback=None, source=None):
+    """按图像的相机厂商查找 logo, 找不到时返回 fallback"""
+    manufacturer = get_manufacturer(image_path, source)
+    if manufacturer:
+        return find_logo(manufacturer) or fallback
+    return fallback
 
-        focal_length_35 = exif_data.get(piexif.ExifIFD.FocalLengthIn35mmFilm, (0, 1))
-        #Some photos don't have focal length in 35mm film
-        if focal_length_35 == (0, 1):
-            focal_length = exif_data.get(piexif.ExifIFD.FocalLength, (0, 1))
-            focal_length_35 = convert_to_int(focal_length)
-        
-        f_number = exif_data.get(piexif.ExifIFD.FNumber, (0, 1))
-        exposure_time = exif_data.get(piexif.ExifIFD.ExposureTime, (0, 1))
-        iso_speed = exif_data.get(piexif.ExifIFD.ISOSpeedRatings, 0)
-        
-        print(focal_length_35)
-
-        focal_length_value = focal_length_35  # 35mm 焦距
-        f_number_value = f_number[0] / f_number[1] if f_number[1] != 0 else 0
-        exposure_time_value = exposure_time[0] / exposure_time[1] if exposure_time[1] != 0 else 0
-
-        return focal_length_value, f_number_value, exposure_time_value, iso_speed
-    except KeyError:
+def find_logo_for_metadata(metadata, fallback=None):
+    """与 find_logo_for_image 相同, 但使用已经读取的 ImageMetadata, 不再解析 EXIF"""
+    manufacturer = manufacturer_name(metadata)
+    if manufacturer:
+        return find_logo(manufacturer) or fallback
+    return fallback
+
+def exif_table(metadata):
+    """界面 EXIF 表格中的 (焦距, 光圈, 快门, ISO), 没有 EXIF 时都为 None"""
+    if metadata.exif_dict is None:
         return None, None, None, None
+    return metadata.focal_length, metadata.aperture, metadata.exposure_time, metadata.iso
+
+def get_exif_table(image_path):
+    try:
+        return exif_table(get_metadata(image_path))
     except Exception as e:
-        print(f"Error getting EXIF table: {e}")
+        logger.warning("Error getting EXIF table: %s", e)
         return None, None, None, None
 
-def get_exif_data(image_path):
+def exif_text(metadata):
+    """
+    水印中的 (镜头和相机, 拍摄参数和时间) 两段文字, 没有 EXIF 时都为 None
+    :raises ValueError: 拍摄时间格式不正确等情况
+    """
     dji_models = {
         'FC8482': 'DJI Mini 4 Pro',
         'FC7703': 'DJI Mini 2 SE'
         # todo: need to add more dji models
     }
 
-    try:
-        image = Image.open(image_path)
-        exif_dict = piexif.load(image.info['exif'])
-        exif_data = exif_dict['Exif']
-
-        lens_info = exif_data.get(piexif.ExifIFD.LensModel, b"Unknown Lens").decode()
-        camera_make = exif_dict['0th'].get(piexif.ImageIFD.Make, b"Unknown Make").decode()
-        camera_model_code = exif_dict['0th'].get(piexif.ImageIFD.Model, b"Unknown Model").decode()
-
-        for letter in camera_make:
-            if letter in 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ':
-                continue
-            else:
-                camera_make = camera_make.replace(letter, '')
-
-        for letter in camera_model_code:
-            if letter in 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ1234567890- ':
-                continue
-            else:
-                camera_model_code = camera_model_code.replace(letter, '')
-    
-        focal_length_value, f_number_value, exposure_time_value, iso_speed = get_exif_table(image_path)
-        
-        datetime = exif_data.get(piexif.ExifIFD.DateTimeOriginal, b"Unknown Date").decode()
-        date_part, time_part = datetime.split(" ")
-        formatted_date = date_part.replace(":", "-")
-        datetime = f"{formatted_date} {time_part}"
-        
-        camera_model = dji_models.get(camera_model_code, camera_model_code) #In case dji has unknown model code
-
-        # Format shooting_info only if values are valid
-        if focal_length_value and f_number_value and exposure_time_value:
-            shooting_info = f"{focal_length_value}mm f/{f_number_value} 1/{int(1 / exposure_time_value)}s ISO{iso_speed}\n{datetime}"
-        else:
-            shooting_info = "Invalid shooting info\n" + datetime
-
-        camera_info = f"{lens_info}\n{camera_model}"
-
-        return camera_info, shooting_info
-    except KeyError:
+    if metadata.exif_dict is None:
         return None, None
+
+    lens_info = metadata.lens if metadata.lens is not None else "Unknown Lens"
+    camera_model_code = metadata.model if metadata.model is not None else "Unknown Model"
+    camera_model_code = keep_characters(camera_model_code, 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ1234567890- ')
+
+    focal_length_value = metadata.focal_length
+    f_number_value = metadata.aperture
+    exposure_time_value = metadata.exposure_time
+    iso_speed = metadata.iso
+
+    datetime = metadata.datetime if metadata.datetime is not None else "Unknown Date"
+    date_part, time_part = datetime.split(" ")
+    formatted_date = date_part.replace(":", "-")
+    datetime = f"{formatted_date} {time_part}"
+
+    camera_model = dji_models.get(camera_model_code, camera_model_code) #In case dji has unknown model code
+
+    # Format shooting_info only if values are valid
+    if focal_length_value and f_number_value and exposure_time_value:
+        shooting_info = f"{focal_length_value}mm f/{f_number_value} 1/{int(1 / exposure_time_value)}s ISO{iso_speed}\n{datetime}"
+    else:
+        shooting_info = "Invalid shooting info\n" + datetime
+
+    camera_info = f"{lens_info}\n{camera_model}"
+
+    return camera_info, shooting_info
+
+def get_exif_data(image_path):
+    try:
+        return exif_text(get_metadata(image_path))
     except Exception as e:
-        print(f"Error getting EXIF data: {e}")
+        logger.warning("Error getting EXIF data: %s", e)
         return None, None
-
@@ -0,0 +1,131 @@
+from PIL import Image, ImageDraw, ImageFont
+from collections import OrderedDict
+from functools import lru_cache
+import threading
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+FONT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fonts")
+
+# 按顺序查找, 使用第一个存在的字体文件
+BOLD_FONT_CANDIDATES = (
+    os.path.join(FONT_DIR, "AlibabaPuHuiTi-2-85-Bold.otf"),
+    os.path.join(FONT_DIR, "Roboto-Bold.ttf"),
+)
+LIGHT_FONT_CANDIDATES = (
+    os.path.join(FONT_DIR, "Roboto-Regular.ttf"),
+    os.path.join(FONT_DIR, "Roboto-Light.ttf"),
+)
+
+# 文字印章缓存的上限 (字节), 一行 100 px 的文字约 100 KB
+TEXT_STAMP_CACHE_BYTES = 64 * 2 ** 20
+
+
+def resolve_font_path(candidates):
+    """返回第一个存在的字体路径, 都不存在时返回 None, 此时使用 Pillow 自带字体"""
+    for path in candidates:
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+@lru_cache(maxsize=64)
+def get_font(font_path, size):
+    """每个进程中每种字体和字号只加载一次"""
+    if font_path is None:
+        return ImageFont.load_default(size)
+    try:
+        return ImageFont.truetype(font_path, size)
+    except OSError as e:
+        logger.warning("Error loading font %s: %s", font_path, e)
+        return ImageFont.load_default(size)
+
+
+# textbbox 只依赖文字和字体, 在 1x1 的图像上测量即可
+_measure_draw = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+
+
+@lru_cache(maxsize=4096)
+def text_bbox(text, font):
+    """
+    缓存文字的包围盒, 镜头、机型等字符串在一批图像中会反复出现
+    font 需来自 get_font, 以保证同一字体对象被复用
+    """
+    return _measure_draw.textbbox((0, 0), text, font=font)
+
+
+class TextStampCache:
+    """
+    缓存栅格化后的单行文字 (L 模式的遮罩), 按 (字体, 文字) 作为键, 总大小超过 max_bytes 时淘汰最久未使用的条目
+    同一批照片的镜头、机型等文字只栅格化一次, 之后每张图只需按遮罩填色;
+    文字第一次出现时只记录下来, 第二次出现才生成遮罩, 快门、时间等每张都不同的文字不会占用缓存
+    """
+
+    def __init__(self, max_bytes=TEXT_STAMP_CACHE_BYTES, max_entries=4096):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._stamps = OrderedDict()  # (id(font), text) -> (遮罩, (左, 上), font), 只出现过一次时遮罩为 None
+        self._lock = threading.Lock()
+
+    def get(self, text, font):
+        """
+        :return: (遮罩, (左, 上)), 把遮罩贴到 (x + 左, y + 上) 与 draw.text((x, y), text) 的结果相同;
+                 文字第一次出现时返回 None, 调用方直接绘制
+        """
+        # 条目保存了 font 的引用, id 在条目存在期间不会被复用
+        key = (id(font), text)
+        with self._lock:
+            entry = self._stamps.get(key)
+            if entry is not None:
+                self._stamps.move_to_end(key)
+                if entry[0] is not None:
+                    self.hits += 1
+                    return entry[0], entry[1]
+            self.misses += 1
+            if entry is None:
+                self._add(key, (None, None, font))
+                return None
+
+        left, top, right, bottom = text_bbox(text, font)
+        stamp = Image.new("L", (max(1, right - left), max(1, bottom - top)), 0)
+        ImageDraw.Draw(stamp).text((-left, -top), text, font=font, fill=255)
+        with self._lock:
+            self._add(key, (stamp, (left, top), font))
+        return stamp, (left, top)
+
+    def _add(self, key, entry):
+        previous = self._stamps.pop(key, None)
+        if previous is not None and previous[0] is not None:
+            self.bytes -= previous[0].width * previous[0].height
+        self._stamps[key] = entry
+        if entry[0] is not None:
+            self.bytes += entry[0].width * entry[0].height
+        while (self.bytes > self.max_bytes or len(self._stamps) > self.max_entries) and len(self._stamps) > 1:
+            evicted = self._stamps.popitem(last=False)[1][0]
+            if evicted is not None:
+                self.bytes -= evicted.width * evicted.height
+
+    def clear(self):
+        with self._lock:
+            self._stamps.clear()
+            self.bytes = 0
+
+
+_text_stamps = TextStampCache()
+
+
+def text_stamp(text, font):
+    """
+    进程内共享的 TextStampCache, font 需来自 get_font
+    :return: (遮罩, (左, 上)), 文字第一次出现时返回 None
+    """
+    return _text_stamps.get(text, font)
+
+
+def text_stamp_cache():
+    return _text_stamps
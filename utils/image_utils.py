@@ -1,33 +1,132 @@
-from PyQt5.QtGui import QImage
-def pil_image_to_qimage(pil_image):
+from PIL import Image
+import logging
+
+logger = logging.getLogger(__name__)
+
+# PIL 模式 -> (tobytes 使用的 raw 模式, QImage 格式名, 每像素字节数)
+# 每行都是 4 字节的整数倍或显式给出 bytesPerLine, 宽度不是 4 的倍数时也不会错行
+QIMAGE_FORMATS = {
+    'RGB': ('RGBX', 'Format_RGBX8888', 4),
+    'RGBA': ('RGBA', 'Format_RGBA8888', 4),
+    'RGBX': ('RGBX', 'Format_RGBX8888', 4),
+    'L': ('L', 'Format_Grayscale8', 1),
+}
+
+def pil_image_to_qimage(pil_image, max_size=None):
     """
     将PIL Image转换为QImage
+    RGB/RGBA/L 图像不做 convert, 只用 tobytes 按 QImage 的行格式复制一次像素,
+    QImage 直接引用这块内存 (Pillow 的内部存储不连续, 无法再省去这次复制)
     :param pil_image: PIL Image对象
-    :return: QImage对象
+    :param max_size: (宽, 高), 给出时先缩小到该尺寸以内再转换, 只复制显示所需的像素
+    :return: QImage对象, 像素内存由 qimage._buffer 保持引用
     """
-    # 将PIL图像转换为RGB格式，如果已经是RGB，这步骤不会改变图像
-    pil_image = pil_image.convert("RGB")
+    # 延迟导入, 让渲染模块在没有 PyQt5 的环境中也能使用本文件
+    from PyQt5.QtGui import QImage
 
-    # 将PIL图像数据转换为字节串
-    image_data = pil_image.tobytes()
+    if max_size is not None and (pil_image.width > max_size[0] or pil_image.height > max_size[1]):
+        # resize 直接生成缩小后的图像, 不先复制一张全尺寸的图像
+        scale = min(max_size[0] / pil_image.width, max_size[1] / pil_image.height)
+        size = (max(1, round(pil_image.width * scale)), max(1, round(pil_image.height * scale)))
+        if pil_image.mode not in QIMAGE_FORMATS:
+            pil_image = pil_image.convert('RGBA' if 'A' in pil_image.getbands() else 'RGB')
+        pil_image = pil_image.resize(size, Image.BILINEAR, reducing_gap=2.0)
 
-    # 创建QImage对象
-    qimage = QImage(image_data, pil_image.width, pil_image.height, QImage.Format_RGB888)
+    if pil_image.mode not in QIMAGE_FORMATS:
+        # 其它模式 (P, CMYK, I;16 ...) 需要先转换
+        pil_image = pil_image.convert('RGBA' if 'A' in pil_image.getbands() else 'RGB')
+    raw_mode, format_name, pixel_bytes = QIMAGE_FORMATS[pil_image.mode]
 
-    # 返回转换后的QImage对象
+    image_data = pil_image.tobytes('raw', raw_mode)
+    qimage = QImage(image_data, pil_image.width, pil_image.height, pil_image.width * pixel_bytes,
+                    getattr(QImage, format_name))
+    # QImage 不拥有 image_data, 必须与 QImage 同时存活
+    qimage._buffer = image_data
     return qimage
 
-def reset_image_orientation(image):
+def image_buffer_bytes(mode, size):
+    """Pillow 为该模式和尺寸分配的像素内存, 多通道模式每像素占 4 字节"""
+    width, height = size
+    if mode in ('1', 'L', 'P'):
+        return width * height
+    if mode.startswith('I;16'):
+        return width * height * 2
+    return width * height * 4
+
+def can_decode_into(image, mode):
+    """image 是否可以用 decode_into 直接解码到 mode 模式的画布中"""
+    return (image.format == 'JPEG' and image.mode == mode and len(image.tile) == 1
+            and tuple(image.tile[0][1]) == (0, 0) + image.size)
+
+def decode_into(image, canvas, position):
+    """
+    把尚未解码的 JPEG 直接解码到 canvas 的 position 处, 不额外分配一张全尺寸位图
+    用到 Pillow 的内部接口 (Image._getdecoder, canvas.im), 接口变化时返回 False
+    :return: 成功返回 True; 格式、模式或分块不支持时返回 False, 此时调用方应改用 load() 后 paste,
+             canvas 中可能已经写入部分像素
+    """
+    if not can_decode_into(image, canvas.mode):
+        return False
+    try:
+        _decode_tile_into(image, canvas, position)
+    except (AttributeError, TypeError) as e:
+        logger.debug("Cannot decode %s into the canvas, falling back to paste: %s", image.filename, e)
+        return False
+    return True
+
+def _decode_tile_into(image, canvas, position):
+    decoder_name, extents, offset, args = image.tile[0]
+
+    x, y = position
+    read = getattr(image, 'load_read', image.fp.read)
+    image.fp.seek(offset)
+    decoder = Image._getdecoder(image.mode, decoder_name, args, image.decoderconfig)
+    try:
+        decoder.setimage(canvas.im, (x, y, x + image.width, y + image.height))
+        data = b""
+        while True:
+            chunk = read(image.decodermaxblock)
+            if not chunk:
+                raise OSError(f"image file is truncated ({len(data)} bytes not processed)")
+            data += chunk
+            consumed, err_code = decoder.decode(data)
+            if consumed < 0:
+                break
+            data = data[consumed:]
+    finally:
+        decoder.cleanup()
+    if err_code < 0:
+        raise OSError(f"decoder error {err_code}")
+
+def oriented_size(width, height, orientation):
+    """按 EXIF 方向旋转后的图像尺寸"""
+    if orientation in (5, 6, 7, 8):
+        return height, width
+    return width, height
+
+# EXIF 方向值对应的无损 transpose 操作, 1 为正常方向不需要处理
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+def reset_image_orientation(image, orientation=None):
+    """
+    按 EXIF 方向信息旋转/镜像图像, 支持全部 8 种方向, 使用 transpose 不做重采样
+    :param orientation: 已知的方向值, 为 None 时从图像中读取 EXIF
+    :return: 方向正常时返回原图像, 否则返回新图像
+    """
     try:
-        exif = image._getexif()
-        if exif:
-            orientation = exif.get(274)
-            if orientation == 3:
-                image = image.rotate(180, expand=True)
-            elif orientation == 6:
-                image = image.rotate(270, expand=True)
-            elif orientation == 8:
-                image = image.rotate(90, expand=True)
+        if orientation is None:
+            orientation = image.getexif().get(274)
+        method = ORIENTATION_TRANSPOSE.get(orientation)
+        if method is not None:
+            image = image.transpose(method)
     except Exception as e:
-        print(f"Error resetting orientation: {e}")
+        logger.warning("Error resetting orientation: %s", e)
     return image
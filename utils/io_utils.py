@@ -0,0 +1,152 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from collections import deque
+import threading
+import time
+import os
+
+# 渲染前后的读写阶段: 后台线程预读输入文件, 编码结果交给写入线程保存,
+# 网络存储上读写等待时 CPU 可以继续渲染
+
+# 最多预读的文件数和字节数
+PREFETCH_DEPTH = 4
+PREFETCH_BYTES = 256 * 2 ** 20
+WRITER_THREADS = 2
+
+
+def write_atomic(path, data):
+    """
+    先写入同一目录下的临时文件再重命名, 读取方不会看到写了一半的输出
+    :raises OSError: 写入或重命名失败时, 临时文件会被删除
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    temp_path = os.path.join(directory, f".{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except OSError:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+class Prefetcher:
+    """
+    后台线程按顺序把文件读入内存, 最多领先 depth 个文件或 max_bytes 字节
+    读取失败的文件内容为 None, 由渲染时重新打开并报告错误
+    """
+
+    def __init__(self, paths, depth=PREFETCH_DEPTH, max_bytes=PREFETCH_BYTES):
+        self.depth = max(1, depth)
+        self.max_bytes = max_bytes
+        self._paths = list(paths)
+        self._ready = deque()
+        self._buffered = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='prefetch', daemon=True)
+        self._thread.start()
+
+    def _has_room(self):
+        # 至少允许一个文件, 单个文件超过 max_bytes 时也能读取
+        return not self._ready or (len(self._ready) < self.depth and self._buffered < self.max_bytes)
+
+    def _run(self):
+        for path in self._paths:
+            with self._condition:
+                self._condition.wait_for(lambda: self._closed or self._has_room())
+                if self._closed:
+                    return
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except OSError:
+                data = None
+            with self._condition:
+                self._ready.append((path, data))
+                self._buffered += len(data) if data is not None else 0
+                self._condition.notify_all()
+
+    def ready(self):
+        """下一个文件是否已经读完"""
+        with self._condition:
+            return bool(self._ready)
+
+    def get(self):
+        """
+        按输入顺序取下一个文件, 尚未读完时等待
+        :return: (path, data)
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._ready)
+            path, data = self._ready.popleft()
+            self._buffered -= len(data) if data is not None else 0
+            self._condition.notify_all()
+        return path, data
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._ready.clear()
+            self._buffered = 0
+            self._condition.notify_all()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _write_outputs(outputs):
+    """:return: 写入耗时秒数"""
+    start = time.perf_counter()
+    for path, data in outputs:
+        write_atomic(path, data)
+    return time.perf_counter() - start
+
+
+class WriteBehind:
+    """
+    写入线程池, 按提交顺序返回完成的任务; 未完成的写入超过 depth 个时 submit 会等待, 限制内存中的编码结果
+    """
+
+    def __init__(self, threads=WRITER_THREADS, depth=None):
+        self.depth = depth or max(1, threads) * 2
+        self._executor = ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix='writer')
+        self._pending = deque()
+
+    def submit(self, outputs, item):
+        """
+        :param outputs: [(path, data), ...]
+        :param item: 写完后随 completed() 返回的对象
+        """
+        if len(self._pending) >= self.depth:
+            wait([self._pending[0][0]])
+        self._pending.append((self._executor.submit(_write_outputs, outputs), item))
+
+    def completed(self, block=False):
+        """
+        取出已经写完的任务, 保持提交顺序
+        :param block: 为 True 时等待全部写完
+        :return: [(item, seconds, error), ...], error 为写入失败时的 OSError
+        """
+        if block:
+            wait([future for future, _ in self._pending])
+        results = []
+        while self._pending and self._pending[0][0].done():
+            future, item = self._pending.popleft()
+            error = future.exception()
+            results.append((item, None if error else future.result(), error))
+        return results
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,196 @@
+from dataclasses import dataclass, field
+from functools import lru_cache
+import json
+import os
+
+LAYOUTS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            "configs", "layouts.json")
+
+DEFAULT_LAYOUT = "classic"
+
+BAR_SIDES = ('top', 'right', 'bottom', 'left')
+BAR_DIRECTIONS = ('row', 'column')
+ITEM_TYPES = ('text', 'logo', 'divider')
+GROUPS = ('start', 'center', 'end')
+
+
+@dataclass(frozen=True)
+class LayoutTemplate:
+    """
+    水印布局模板, 定义在 configs/layouts.json 中, 长度单位为参考分辨率下的像素
+    border 为照片四周的边框 (上, 右, 下, 左); bar 为放置文字和 logo 的那一侧边框,
+    其中的元素按 start/center/end 三组沿 direction 方向排列
+    reference_short_edge 为 None 时不随图像分辨率缩放
+    """
+    name: str
+    border: tuple = (0, 0, 0, 0)
+    bar: dict = field(default_factory=dict)
+    text_size: int = 100
+    line_height: int = 120
+    start: tuple = ()
+    center: tuple = ()
+    end: tuple = ()
+    reference_short_edge: int = None
+    background: tuple = (255, 255, 255)
+    text_color: tuple = (0, 0, 0)
+    description: str = ''
+
+
+@dataclass(frozen=True)
+class LayoutItem:
+    """
+    编译后的布局元素, 长度已换算为像素
+    gap 为与同组前一个元素的间距; offset 为在边框内垂直于排列方向的偏移, 'center' 表示居中
+    """
+    type: str
+    source: str = None
+    lines: tuple = None
+    fonts: tuple = ('bold', 'light')
+    gap: int = 0
+    offset: object = 0
+    height: int = 0
+    length: int = 0
+    width: int = 0
+
+
+@dataclass(frozen=True)
+class LayoutPlan:
+    """
+    一个模板在某个照片尺寸下的几何布局, 按 (模板, 照片尺寸, 缩放) 缓存,
+    渲染时只需测量文字宽度、绘制文字和粘贴 logo
+    """
+    name: str
+    canvas_size: tuple
+    photo_position: tuple
+    bar: tuple  # 边框区域 (x0, y0, x1, y1)
+    direction: str
+    margin: int
+    text_size: int
+    line_height: int
+    groups: tuple  # ((组名, (LayoutItem, ...)), ...)
+    logo_height: int = None
+    background: tuple = (255, 255, 255)
+    text_color: tuple = (0, 0, 0)
+
+
+def validate_template(template):
+    """:raises ValueError: 模板中有未知的取值时"""
+    if len(template.border) != 4:
+        raise ValueError(f"Layout '{template.name}': border needs four values (top, right, bottom, left)")
+    if template.bar.get('side') not in BAR_SIDES:
+        raise ValueError(f"Layout '{template.name}': bar side must be one of {', '.join(BAR_SIDES)}")
+    if template.bar.get('direction', 'row') not in BAR_DIRECTIONS:
+        raise ValueError(f"Layout '{template.name}': bar direction must be one of {', '.join(BAR_DIRECTIONS)}")
+    for group in GROUPS:
+        for item in getattr(template, group):
+            if item.get('type') not in ITEM_TYPES:
+                raise ValueError(f"Layout '{template.name}': unknown item type '{item.get('type')}'")
+
+
+@lru_cache(maxsize=None)
+def load_layouts(path=LAYOUTS_PATH):
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    layouts = {}
+    for name, settings in config.items():
+        settings = dict(settings)
+        for key in ('border', 'background', 'text_color') + GROUPS:
+            if key in settings:
+                settings[key] = tuple(settings[key])
+        template = LayoutTemplate(name=name, **settings)
+        validate_template(template)
+        layouts[name] = template
+    return layouts
+
+
+def available_layouts():
+    return list(load_layouts())
+
+
+def get_layout(name=None):
+    """
+    :raises ValueError: 模板不存在时
+    """
+    layouts = load_layouts()
+    template = layouts.get(name or DEFAULT_LAYOUT)
+    if template is None:
+        raise ValueError(f"Unknown layout '{name}', available: {', '.join(layouts)}")
+    return template
+
+
+def _compile_item(settings, unit):
+    def scaled(value):
+        return round(value * unit)
+
+    offset = settings.get('offset', 0)
+    lines = settings.get('lines')
+    return LayoutItem(
+        type=settings['type'],
+        source=settings.get('source'),
+        lines=tuple(lines) if lines is not None else None,
+        fonts=tuple(settings.get('fonts', ('bold', 'light'))),
+        gap=scaled(settings.get('gap', 0)),
+        offset=offset if offset == 'center' else scaled(offset),
+        height=max(1, scaled(settings.get('height', 0))),
+        length=scaled(settings.get('length', 0)),
+        width=max(1, scaled(settings.get('width', 1))),
+    )
+
+
+@lru_cache(maxsize=256)
+def compile_layout(name, width, height, unit):
+    """
+    把模板编译为 LayoutPlan
+    :param width: 放入画布的照片宽度 (已按方向旋转)
+    :param height: 放入画布的照片高度
+    :param unit: 模板中 1 个单位对应的像素数
+    """
+    template = get_layout(name)
+
+    def scaled(value):
+        return round(value * unit)
+
+    top, right, bottom, left = (scaled(value) for value in template.border)
+    canvas_width, canvas_height = width + left + right, height + top + bottom
+    side = template.bar['side']
+    bar = {
+        'top': (0, 0, canvas_width, top),
+        'bottom': (0, top + height, canvas_width, canvas_height),
+        'left': (0, 0, left, canvas_height),
+        'right': (left + width, 0, canvas_width, canvas_height),
+    }[side]
+
+    groups = tuple((group, tuple(_compile_item(item, unit) for item in getattr(template, group)))
+                   for group in GROUPS if getattr(template, group))
+    logo_heights = [item.height for _, items in groups for item in items if item.type == 'logo']
+
+    return LayoutPlan(
+        name=name,
+        canvas_size=(canvas_width, canvas_height),
+        photo_position=(left, top),
+        bar=bar,
+        direction=template.bar.get('direction', 'row'),
+        margin=scaled(template.bar.get('margin', 0)),
+        text_size=max(1, scaled(template.text_size)),
+        line_height=scaled(template.line_height),
+        groups=groups,
+        logo_height=logo_heights[0] if logo_heights else None,
+        background=tuple(template.background),
+        text_color=tuple(template.text_color),
+    )
+
+
+def get_layout_plan(name, width, height, scale=1.0):
+    """
+    取照片尺寸对应的 LayoutPlan, 设置了 reference_short_edge 的模板按原图短边等比缩放
+    :param width: 放入画布的照片宽度 (已按方向旋转)
+    :param height: 放入画布的照片高度
+    :param scale: 照片相对原图的缩放比例, 预览时小于 1
+    :raises ValueError: 模板不存在时
+    """
+    template = get_layout(name)
+    unit = scale
+    if template.reference_short_edge:
+        unit = min(width, height) / template.reference_short_edge
+    # 取整后相同尺寸的照片可以命中缓存
+    return compile_layout(template.name, width, height, round(unit, 6))
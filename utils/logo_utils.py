@@ -0,0 +1,138 @@
+from PIL import Image
+from collections import OrderedDict
+import threading
+import os
+
+LOGO_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "logos")
+
+LOGO_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# EXIF 中的厂商名(只保留字母并转小写)到 logo 品牌名的别名
+MANUFACTURER_ALIASES = {
+    'nikoncorporation': 'nikon',
+    'olympusimagingcorp': 'olympus',
+    'olympuscorporation': 'olympus',
+    'omdigitalsolutions': 'olympus',
+    'omsystem': 'olympus',
+    'leicacamera': 'leica',
+    'leicacameraag': 'leica',
+    'ricohimagingcompanyltd': 'ricoh',
+    'huawei': 'xmage',
+}
+
+RESIZED_LOGO_CACHE_SIZE = 32
+
+
+def normalize_name(name):
+    return ''.join(letter for letter in name.lower() if letter.isalpha())
+
+
+def split_logo_name(file_name):
+    """
+    把 logo 文件名拆成 (品牌, 变体), 例如
+    sony_dark.png -> ('sony', 'dark'), panasonic2.png -> ('panasonic', '2'), canon.png -> ('canon', '')
+    """
+    stem = os.path.splitext(file_name)[0].lower()
+    brand, _, variant = stem.partition('_')
+    digits = brand.lstrip('abcdefghijklmnopqrstuvwxyz')
+    if digits:
+        brand, variant = brand[:-len(digits)], (digits + '_' + variant).strip('_')
+    return brand, variant
+
+
+class LogoRegistry:
+    """
+    启动时扫描一次 logo 目录, 建立 品牌 -> {变体: 路径} 的索引,
+    并缓存按目标高度缩放好的 RGBA logo
+    """
+
+    def __init__(self, logo_dir=LOGO_DIR, aliases=MANUFACTURER_ALIASES, cache_size=RESIZED_LOGO_CACHE_SIZE):
+        self.logo_dir = logo_dir
+        self.aliases = dict(aliases)
+        self.cache_size = cache_size
+        self.logos = {}
+        self._resized = OrderedDict()
+        self._lock = threading.Lock()
+        self.scan()
+
+    def scan(self):
+        logos = {}
+        if os.path.isdir(self.logo_dir):
+            for root, dirs, files in os.walk(self.logo_dir):
+                dirs.sort()
+                for file in sorted(files):
+                    if not file.lower().endswith(LOGO_EXTENSIONS):
+                        continue
+                    brand, variant = split_logo_name(file)
+                    logos.setdefault(brand, {}).setdefault(variant, os.path.join(root, file))
+        self.logos = logos
+
+    def brands(self):
+        return sorted(self.logos)
+
+    def resolve_brand(self, manufacturer):
+        name = normalize_name(manufacturer or '')
+        if not name:
+            return None
+        name = self.aliases.get(name, name)
+        if name in self.logos:
+            return name
+        # 兼容原来的前缀匹配, 例如 NIKONCORPORATION -> nikon
+        for brand in sorted(self.logos, key=len, reverse=True):
+            if name.startswith(brand) or brand.startswith(name):
+                return brand
+        return None
+
+    def find(self, manufacturer, variant=''):
+        """
+        :param variant: 变体名, 例如 'dark', 不存在时退回默认 logo
+        :return: logo 路径, 找不到时返回 None
+        """
+        brand = self.resolve_brand(manufacturer)
+        if brand is None:
+            return None
+        variants = self.logos[brand]
+        if variant in variants:
+            return variants[variant]
+        if '' in variants:
+            return variants['']
+        return variants[sorted(variants)[0]]
+
+    def get_resized(self, logo_path, target_height):
+        """
+        读取 logo, 转为 RGBA 并缩放到 target_height, 结果按 (路径, mtime, 高度) 缓存
+        返回的图像是共享的, 调用方不能修改
+        """
+        target_height = max(1, round(target_height))
+        key = (os.path.abspath(logo_path), os.stat(logo_path).st_mtime_ns, target_height)
+        with self._lock:
+            logo = self._resized.get(key)
+            if logo is not None:
+                self._resized.move_to_end(key)
+                return logo
+
+        with Image.open(logo_path) as source:
+            logo = source.convert("RGBA")
+        logo_width, logo_height = logo.size
+        logo_resize_factor = target_height / logo_height
+        logo = logo.resize((max(1, int(logo_width * logo_resize_factor)), max(1, int(logo_height * logo_resize_factor))),
+                           Image.LANCZOS)
+
+        with self._lock:
+            self._resized[key] = logo
+            while len(self._resized) > self.cache_size:
+                self._resized.popitem(last=False)
+        return logo
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_logo_registry():
+    """进程内共享的 LogoRegistry, 第一次调用时扫描 logo 目录"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = LogoRegistry()
+        return _registry
@@ -0,0 +1,198 @@
+from functools import lru_cache
+from dataclasses import asdict
+import hashlib
+import json
+import os
+
+from utils.encode_utils import get_output_profile
+from utils.exif_utils import find_logo_for_image
+from utils.layout_utils import get_layout
+import utils.render_utils as render_utils
+
+# 输出目录中记录已渲染文件的清单, 重复运行时跳过没有变化的输入
+MANIFEST_NAME = ".autowatermark_manifest.json"
+MANIFEST_VERSION = 1
+
+
+@lru_cache(maxsize=256)
+def _file_hash(path, mtime_ns, size):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_hash(path):
+    """文件内容的 sha1, 按 (路径, mtime, 大小) 缓存; 文件不存在时返回 None"""
+    if not path:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return _file_hash(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+def settings_hash(profile_name, layout_name=None):
+    """影响输出像素和编码的全部设置: 布局模板、字体文件和输出配置"""
+    profile = get_output_profile(profile_name)
+    settings = {
+        'version': MANIFEST_VERSION,
+        'layout': asdict(get_layout(layout_name)),
+        'fonts': [file_hash(render_utils.GLOBAL_FONT_PATH_BOLD), file_hash(render_utils.GLOBAL_FONT_PATH_LIGHT)],
+        'profile': [profile.name, profile.format, profile.max_long_edge, profile.options],
+    }
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+
+def job_fingerprint(job, previous=None):
+    """
+    描述一个任务输入的字典, 与清单中记录的相同且输出文件存在时可以跳过
+    :param previous: 清单中这个输入上次的记录, 文件大小和修改时间都没变时沿用其中的 logo 路径,
+                     不再打开文件解析 EXIF
+    :raises OSError: 输入文件不存在时
+    """
+    stat = os.stat(job.image_path)
+    if not job.auto_logo:
+        logo_path = job.logo_path
+    elif (previous is not None and 'logo_path' in previous and previous.get('size') == stat.st_size
+          and previous.get('mtime_ns') == stat.st_mtime_ns and previous.get('logo_fallback') == job.logo_path):
+        logo_path = previous['logo_path']
+    else:
+        logo_path = find_logo_for_image(job.image_path, job.logo_path)
+    fingerprint = {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'logo_path': logo_path,
+        'logo_fallback': job.logo_path,
+        'logo': file_hash(logo_path),
+        'settings': settings_hash(job.profile, job.layout),
+        'output_path': os.path.abspath(job.output_path),
+    }
+    if job.renditions:
+        fingerprint['renditions'] = [[os.path.abspath(output_path), settings_hash(profile, job.layout)]
+                                     for output_path, profile in job.renditions]
+    return fingerprint
+
+
+def listed_roots(roots):
+    """能列出且不为空的目录的绝对路径; 未挂载的挂载点通常是空目录, 不作为删除输出的依据"""
+    listed = []
+    for root in roots:
+        try:
+            with os.scandir(root) as entries:
+                if next(entries, None) is None:
+                    continue
+        except OSError:
+            continue
+        listed.append(os.path.abspath(root))
+    return listed
+
+
+def is_under_roots(path, roots, recursive=False):
+    """path 是否直接位于 roots 中的某个目录下, recursive 时也包括子目录"""
+    directory = os.path.dirname(path)
+    return any(directory == root or (recursive and directory.startswith(os.path.join(root, '')))
+               for root in roots)
+
+
+class OutputManifest:
+    """
+    输出目录中的渲染清单, 以输入文件的绝对路径为键
+    """
+
+    def __init__(self, output_dir, entries=None):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        self.entries = entries or {}
+        self._pending = {}
+
+    @classmethod
+    def load(cls, output_dir):
+        path = os.path.join(output_dir, MANIFEST_NAME)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == MANIFEST_VERSION:
+                return cls(output_dir, data.get('entries', {}))
+        except (OSError, ValueError):
+            pass
+        return cls(output_dir)
+
+    def plan(self, jobs, force=False):
+        """
+        把任务分为需要渲染和可以跳过两组
+        :param force: 为 True 时全部重新渲染
+        :return: (pending, skipped)
+        """
+        pending, skipped = [], []
+        for job in jobs:
+            key = os.path.abspath(job.image_path)
+            try:
+                fingerprint = job_fingerprint(job, self.entries.get(key))
+            except OSError:
+                pending.append(job)
+                continue
+            if (not force and self.entries.get(key) == fingerprint
+                    and all(os.path.isfile(output_path) for output_path in job.output_paths)):
+                skipped.append(job)
+            else:
+                self._pending[key] = fingerprint
+                pending.append(job)
+        return pending, skipped
+
+    def record(self, result):
+        """记录渲染成功的任务, 失败的任务从清单中移除以便下次重试"""
+        key = os.path.abspath(result.image_path)
+        fingerprint = self._pending.pop(key, None)
+        if result.ok and fingerprint is not None:
+            self.entries[key] = fingerprint
+        elif result.error is not None:
+            self.entries.pop(key, None)
+
+    def output_paths(self):
+        """清单中记录的全部输出文件的绝对路径, 输出目录位于输入目录中时用来跳过上次的输出"""
+        paths = set()
+        for entry in self.entries.values():
+            paths.update(path for path in [entry.get('output_path')] + [path for path, _ in entry.get('renditions', ())]
+                         if path)
+        return paths
+
+    def prune(self, roots=(), recursive=False, force=False):
+        """
+        删除输入文件已经不存在的输出文件和清单条目
+        只检查 roots 中 (recursive 时包括子目录) 的条目, 并且 roots 必须能列出且不为空,
+        所在目录也必须存在, 避免网络存储未挂载时把全部输出当作过期删除
+        :param roots: 本次扫描的输入目录
+        :param force: 为 True 时检查清单中的全部条目 (命令行 --prune)
+        :return: 被删除的输出文件路径
+        """
+        if not force:
+            roots = listed_roots(roots)
+            if not roots:
+                return []
+        removed = []
+        for key, entry in list(self.entries.items()):
+            if os.path.exists(key):
+                continue
+            if not force and not (is_under_roots(key, roots, recursive) and os.path.isdir(os.path.dirname(key))):
+                continue
+            output_paths = [entry.get('output_path')] + [path for path, _ in entry.get('renditions', ())]
+            for output_path in output_paths:
+                if output_path and os.path.isfile(output_path):
+                    try:
+                        os.remove(output_path)
+                        removed.append(output_path)
+                    except OSError:
+                        continue
+            del self.entries[key]
+        return removed
+
+    def save(self):
+        """先写临时文件再替换, 中途退出不会留下损坏的清单"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': MANIFEST_VERSION, 'entries': self.entries}, f, ensure_ascii=False, indent=1)
+        os.replace(temp_path, self.path)
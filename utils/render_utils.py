@@ -0,0 +1,360 @@
+from PIL import Image, ImageDraw
+import io
+import os
+
+from utils.exif_utils import exif_text, get_metadata, get_output_exif
+from utils.image_utils import reset_image_orientation, oriented_size, can_decode_into, decode_into
+from utils.logo_utils import get_logo_registry
+from utils.encode_utils import OutputProfile, get_output_profile, encode_renditions
+from utils.trace_utils import JobTrace
+from utils.font_utils import BOLD_FONT_CANDIDATES, LIGHT_FONT_CANDIDATES, get_font, resolve_font_path, text_bbox, \
+    text_stamp
+from utils.layout_utils import DEFAULT_LAYOUT, get_layout_plan
+from utils.io_utils import write_atomic
+
+# 渲染模块只依赖 Pillow 和 piexif, 不导入 PyQt5, 可以在无界面的服务器上运行
+
+# 缺少首选字体时退回 fonts/ 中的其它字体
+GLOBAL_FONT_PATH_BOLD = resolve_font_path(BOLD_FONT_CANDIDATES)
+GLOBAL_FONT_PATH_LIGHT = resolve_font_path(LIGHT_FONT_CANDIDATES)
+
+PREVIEW_SIZE = (800, 600)
+
+
+class WatermarkError(Exception):
+    """
+    渲染失败的基类
+    message_key 对应 configs/i18n.json 中的提示文本, 供 GUI 显示
+    """
+    title_key = 'error_title'
+    message_key = 'exif_error'
+
+
+class ImageReadError(WatermarkError):
+    message_key = 'exif_error'
+
+
+class ExifError(WatermarkError):
+    message_key = 'exif_error'
+
+
+class LogoError(WatermarkError):
+    message_key = 'logo_error'
+
+
+class OutputError(WatermarkError):
+    message_key = 'output_error'
+
+
+class LayoutError(WatermarkError):
+    message_key = 'layout_error'
+
+
+def load_metadata(image_path, source=None):
+    try:
+        metadata = get_metadata(image_path, source)
+    except Exception as e:
+        raise ExifError(f"Cannot read EXIF data from '{image_path}': {e}") from e
+    if metadata.exif_bytes is None:
+        raise ExifError(f"No EXIF data in '{image_path}'")
+    return metadata
+
+
+def open_image(image_path, source=None):
+    """:param source: 已经读入内存的文件内容, 给出时不再读取 image_path"""
+    try:
+        return Image.open(io.BytesIO(source) if source is not None else image_path)
+    except Exception as e:
+        raise ImageReadError(f"Cannot open image '{image_path}': {e}") from e
+
+
+def load_reduced_image(image_path, orientation, max_size):
+    """
+    以缩小的尺寸解码图像, JPEG 使用 draft 模式直接按 1/2, 1/4, 1/8 解码, 不生成全尺寸位图
+    :param max_size: 旋转后图像允许的最大 (宽, 高)
+    """
+    try:
+        image = Image.open(image_path)
+    except Exception as e:
+        raise ImageReadError(f"Cannot open image '{image_path}': {e}") from e
+    max_width, max_height = max_size
+    max_width, max_height = oriented_size(max_width, max_height, orientation)
+    image.thumbnail((max(1, max_width), max(1, max_height)), Image.LANCZOS, reducing_gap=2.0)
+    return reset_image_orientation(image, orientation)
+
+
+def load_logo(logo_path, target_height=200):
+    """从 LogoRegistry 的缓存中取缩放好的 logo, 返回的图像不能修改"""
+    try:
+        return get_logo_registry().get_resized(logo_path, target_height)
+    except Exception as e:
+        raise LogoError(f"Cannot open logo '{logo_path}': {e}") from e
+
+
+def load_output_profile(profile):
+    """:raises OutputError: 输出配置不存在或不受支持时"""
+    if isinstance(profile, OutputProfile):
+        return profile
+    try:
+        return get_output_profile(profile)
+    except ValueError as e:
+        raise OutputError(str(e)) from e
+
+
+def load_layout_plan(layout, width, height, scale=1.0):
+    """:raises LayoutError: 模板不存在时"""
+    try:
+        return get_layout_plan(layout or DEFAULT_LAYOUT, width, height, scale)
+    except ValueError as e:
+        raise LayoutError(str(e)) from e
+
+
+def compose_watermark(image, camera_info, shooting_info, logo, plan):
+    """
+    按布局在图像四周加边框, 并在边框中绘制相机/镜头信息、拍摄参数和 logo
+    :param plan: 与 image 尺寸对应的 LayoutPlan, 预览时按缩小后的尺寸编译
+    :return: 新的 RGB 图像
+    """
+    new_image = Image.new("RGB", plan.canvas_size, plan.background)
+    new_image.paste(image, plan.photo_position)
+    draw_watermark(new_image, camera_info, shooting_info, logo, plan)
+    return new_image
+
+
+def layout_fonts(item, plan):
+    """元素每一行使用的字体, 行数多于 fonts 时沿用最后一种"""
+    paths = {'bold': GLOBAL_FONT_PATH_BOLD, 'light': GLOBAL_FONT_PATH_LIGHT}
+    return [get_font(paths.get(name, GLOBAL_FONT_PATH_BOLD), plan.text_size) for name in item.fonts]
+
+
+def measure_item(item, plan, texts, logo):
+    """
+    :return: (宽, 高, 文字行), 分隔线宽高为 0, 只占用间距
+    """
+    if item.type == 'text':
+        lines = texts.get(item.source, '').split('\n')
+        if item.lines is not None:
+            lines = [lines[index] for index in item.lines if index < len(lines)]
+        bbox = text_bbox('\n'.join(lines), layout_fonts(item, plan)[0])
+        return bbox[2] - bbox[0], (len(lines) - 1) * plan.line_height + plan.text_size, lines
+    if item.type == 'logo':
+        return (logo.size[0], logo.size[1], None) if logo is not None else (0, 0, None)
+    return 0, 0, None
+
+
+def draw_watermark(new_image, camera_info, shooting_info, logo, plan):
+    """在已经放好照片的画布上, 按 LayoutPlan 排列并绘制文字、logo 和分隔线"""
+    draw = ImageDraw.Draw(new_image)
+    texts = {'camera': camera_info, 'shooting': shooting_info}
+    x0, y0, x1, y1 = plan.bar
+    row = plan.direction == 'row'
+    main_start, main_end = (x0, x1) if row else (y0, y1)
+    cross_start, cross_size = (y0, y1 - y0) if row else (x0, x1 - x0)
+
+    for group, items in plan.groups:
+        measured = [measure_item(item, plan, texts, logo) for item in items]
+        main_sizes = [width if row else height for width, height, _ in measured]
+        # 每组元素依次排列, 组内第一个元素前不留间距
+        total = sum(main_sizes) + sum(item.gap for item in items[1:])
+        if group == 'start':
+            position = main_start + plan.margin
+        elif group == 'end':
+            position = main_end - plan.margin - total
+        else:
+            position = main_start + round((main_end - main_start - total) / 2)
+
+        for index, (item, (width, height, lines)) in enumerate(zip(items, measured)):
+            if index:
+                position += item.gap
+            if item.type == 'divider':
+                cross = item.length
+            else:
+                cross = height if row else width
+            offset = round((cross_size - cross) / 2) if item.offset == 'center' else item.offset
+            x, y = (position, cross_start + offset) if row else (cross_start + offset, position)
+
+            if item.type == 'text':
+                fonts = layout_fonts(item, plan)
+                for line_index, line in enumerate(lines):
+                    font = fonts[min(line_index, len(fonts) - 1)]
+                    line_y = y + line_index * plan.line_height
+                    # 重复出现的文字直接使用缓存的遮罩, 不再重新栅格化
+                    stamp = text_stamp(line, font)
+                    if stamp is None:
+                        draw.text((x, line_y), line, font=font, fill=plan.text_color)
+                    else:
+                        mask, (left, top) = stamp
+                        new_image.paste(plan.text_color, (int(x + left), int(line_y + top)), mask)
+            elif item.type == 'logo' and logo is not None:
+                new_image.paste(logo, (x, y), logo)
+            elif item.type == 'divider':
+                end = (x, y + item.length) if row else (x + item.length, y)
+                draw.line((x, y) + end, fill=plan.text_color, width=item.width)
+            position += width if row else height
+
+
+def compose_watermark_low_memory(image_path, metadata, camera_info, shooting_info, logo, plan, trace=None,
+                                 data=None):
+    """
+    与 compose_watermark 结果相同, 但尽量只保留一张全尺寸位图:
+    不需要旋转的 RGB JPEG 直接解码到画布中; 其它情况先解码再贴到画布, 并立即释放解码后的图像
+    :param trace: 可选的 JobTrace, 记录 decode/orient/draw 阶段耗时和位图内存峰值
+    :param data: 已经读入内存的文件内容
+    :raises ImageReadError: 图像无法打开或解码时, 例如文件不完整
+    """
+    trace = trace if trace is not None else JobTrace(image_path)
+    buffers = trace.buffers
+
+    source = open_image(image_path, data)
+    with source:
+        decoded = False
+        if metadata.orientation in (None, 1) and can_decode_into(source, "RGB"):
+            with trace.stage('decode'):
+                new_image = Image.new("RGB", plan.canvas_size, plan.background)
+                buffers.allocate(new_image)
+                try:
+                    decoded = decode_into(source, new_image, plan.photo_position)
+                except Exception as e:
+                    raise ImageReadError(f"Cannot open image '{image_path}': {e}") from e
+                if not decoded:
+                    # 当前 Pillow 不支持直接解码, 丢弃画布后按普通路径解码
+                    buffers.release(new_image)
+                    new_image.close()
+        if not decoded:
+            # 先完成解码和旋转再分配画布, 同一时刻最多两张全尺寸位图
+            with trace.stage('decode'):
+                try:
+                    source.load()
+                except Exception as e:
+                    raise ImageReadError(f"Cannot open image '{image_path}': {e}") from e
+                buffers.allocate(source)
+            with trace.stage('orient'):
+                image = reset_image_orientation(source, metadata.orientation)
+                if image is not source:
+                    buffers.allocate(image)
+                    buffers.release(source)
+                    source.close()
+            with trace.stage('draw'):
+                new_image = Image.new("RGB", plan.canvas_size, plan.background)
+                buffers.allocate(new_image)
+                new_image.paste(image, plan.photo_position)
+                buffers.release(image)
+                image.close()
+
+    with trace.stage('draw'):
+        draw_watermark(new_image, camera_info, shooting_info, logo, plan)
+    return new_image
+
+
+def load_camera_info(image_path, metadata=None):
+    try:
+        camera_info, shooting_info = exif_text(metadata if metadata is not None else get_metadata(image_path))
+    except Exception as e:
+        raise ExifError(f"Cannot read camera information from '{image_path}': {e}") from e
+    if camera_info is None or shooting_info is None:
+        raise ExifError(f"Cannot read camera information from '{image_path}'")
+    return camera_info, shooting_info
+
+
+def render_preview(image_path, logo_path, max_size=PREVIEW_SIZE, layout=DEFAULT_LAYOUT):
+    """
+    生成与最终输出布局一致的低分辨率预览, 整个过程不会创建全尺寸画布
+    :param max_size: 预览图(含边框)的最大 (宽, 高)
+    :raises WatermarkError: 图像、EXIF 或 logo 无法读取时
+    """
+    metadata = load_metadata(image_path)
+    camera_info, shooting_info = load_camera_info(image_path, metadata)
+
+    # 按最终画布尺寸计算缩放比例, 让边框也包含在 max_size 内
+    full_width, full_height = oriented_size(metadata.width, metadata.height, metadata.orientation)
+    canvas_width, canvas_height = load_layout_plan(layout, full_width, full_height).canvas_size
+    scale = min(max_size[0] / canvas_width, max_size[1] / canvas_height, 1.0)
+
+    image = load_reduced_image(image_path, metadata.orientation,
+                               (round(full_width * scale), round(full_height * scale)))
+    plan = load_layout_plan(layout, image.width, image.height, image.width / full_width)
+
+    logo = load_logo(logo_path, plan.logo_height) if plan.logo_height else None
+    return compose_watermark(image, camera_info, shooting_info, logo, plan)
+
+
+def add_borders_logo_and_text(image_path, logo_path, output_path = None, preview = False, low_memory = True, trace = None,
+                              profile = None, layout = DEFAULT_LAYOUT, renditions = (), source = None, writer = None,
+                              metadata = None):
+    """
+    渲染一张带水印的图像
+    :param layout: configs/layouts.json 中的布局模板名
+    :param profile: configs/output_profiles.json 中的输出配置名或 OutputProfile, 默认沿用输入格式
+    :param renditions: 同时保存的其它尺寸 ((output_path, profile), ...), 与 output_path 共用一次解码和合成
+    :param source: 已经读入内存的输入文件内容, 给出时不再读取 image_path
+    :param writer: 保存编码结果的函数 writer(path, data), 默认立即用 write_atomic 写入
+    :param metadata: 调用方已经用 load_metadata 读取的 ImageMetadata, 给出时不再解析 EXIF
+    :param low_memory: 使用 compose_watermark_low_memory, 输出相同但峰值内存更低
+    :param trace: 可选的 JobTrace, 记录各阶段耗时、读写字节数和位图内存峰值
+    :return: preview 为 True 时返回 PIL Image, 否则保存到 output_path 并返回该路径
+    :raises WatermarkError: 图像、EXIF 或 logo 无法读取时
+    """
+    # Todo: Add more selections
+    outputs = [(output_path, load_output_profile(profile))]
+    outputs.extend((path, load_output_profile(rendition_profile)) for path, rendition_profile in renditions)
+    trace = trace if trace is not None else JobTrace(image_path)
+
+    with trace.stage('exif'):
+        if metadata is None:
+            metadata = load_metadata(image_path, source)
+        camera_info, shooting_info = load_camera_info(image_path, metadata)
+    trace.set(camera=" ".join(filter(None, (metadata.make, metadata.model))) or None,
+              megapixels=round(metadata.width * metadata.height / 1e6, 1))
+    try:
+        trace.bytes_read += len(source) if source is not None else os.path.getsize(image_path)
+    except OSError:
+        pass
+
+    with trace.stage('logo'):
+        plan = load_layout_plan(layout, *oriented_size(metadata.width, metadata.height, metadata.orientation))
+        logo = load_logo(logo_path, plan.logo_height) if plan.logo_height else None
+
+    if low_memory:
+        new_image = compose_watermark_low_memory(image_path, metadata, camera_info, shooting_info, logo, plan, trace,
+                                                 source)
+    else:
+        with trace.stage('decode'):
+            image = open_image(image_path, source)
+            try:
+                image.load()
+            except Exception as e:
+                raise ImageReadError(f"Cannot open image '{image_path}': {e}") from e
+            trace.buffers.allocate(image)
+        with trace.stage('orient'):
+            oriented = reset_image_orientation(image, metadata.orientation)
+            if oriented is not image:
+                trace.buffers.allocate(oriented)
+        with trace.stage('draw'):
+            new_image = compose_watermark(oriented, camera_info, shooting_info, logo, plan)
+            trace.buffers.allocate(new_image)
+
+    if preview:
+        return new_image
+    # 先编码到内存, 写入时不会留下不完整的输出文件; 沿用输入格式时与以前一样按扩展名决定格式
+    source_format = Image.registered_extensions().get(os.path.splitext(image_path)[1].lower())
+    buffers = [io.BytesIO() for _ in outputs]
+    with trace.stage('encode'):
+        try:
+            encode_renditions(new_image, [(buffer, output_profile) for buffer, (_, output_profile)
+                                          in zip(buffers, outputs)],
+                              exif=get_output_exif(metadata), source_format=source_format)  # 保留exif数据, 方向重置为正常
+        except (OSError, ValueError) as e:
+            raise OutputError(f"Cannot save '{output_path}': {e}") from e
+    for buffer, (path, _) in zip(buffers, outputs):
+        data = buffer.getvalue()
+        buffer.close()
+        trace.bytes_written += len(data)
+        if writer is not None:
+            writer(path, data)
+            continue
+        with trace.stage('write'):
+            try:
+                write_atomic(path, data)
+            except OSError as e:
+                raise OutputError(f"Cannot save '{path}': {e}") from e
+    return output_path
@@ -0,0 +1,464 @@
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import mimetypes
+import threading
+import logging
+import signal
+import queue
+import json
+import time
+import uuid
+import os
+
+from utils.batch_utils import IMAGE_EXTENSIONS, BatchJob, JobResult, build_jobs, default_workers, output_path_for, \
+    render_job, render_pool
+from utils.encode_utils import DEFAULT_PROFILE, DEFAULT_RENDITIONS, get_output_profile
+from utils.layout_utils import DEFAULT_LAYOUT, available_layouts, get_layout
+from utils.logo_utils import get_logo_registry
+from utils.trace_utils import percentile
+
+# 本机 HTTP 渲染服务: 常驻的工作进程预先加载字体、logo 和布局, 每个请求单独提交给空闲的进程
+
+logger = logging.getLogger(__name__)
+
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8765
+# 排队等待渲染的请求数上限, 超过时返回 503
+QUEUE_SIZE = 64
+# 所有进程都在渲染时, 进程空闲后一次最多取出的排队请求数
+BATCH_SIZE = 4
+MAX_UPLOAD_BYTES = 256 * 2 ** 20
+# 保留结果的已完成任务数, 超过时淘汰最早完成的
+FINISHED_JOBS = 128
+LATENCY_WINDOW = 1000
+WAIT_TIMEOUT = 300.0
+# 预热时按这个尺寸的照片编译布局, 加载对应字号的字体和高度的 logo
+WARM_UP_SIZE = (6000, 4000)
+
+UPLOAD_EXTENSIONS = {
+    'image/jpeg': '.jpg',
+    'image/jpg': '.jpg',
+    'image/png': '.png',
+}
+
+
+def _warm_worker(layouts, logo_layout):
+    """
+    工作进程启动时执行一次: 忽略 Ctrl-C, 扫描 logo 目录, 编译布局并加载字体和缩放好的 logo,
+    第一个请求不再承担这些开销
+    """
+    # 放在函数内导入, 主进程只需要 HTTP 部分
+    from utils.render_utils import load_layout_plan, layout_fonts, load_logo
+    from utils.font_utils import text_bbox
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    registry = get_logo_registry()
+    for layout in layouts:
+        plan = load_layout_plan(layout, *WARM_UP_SIZE)
+        for _, items in plan.groups:
+            for item in items:
+                if item.type == 'text':
+                    for font in layout_fonts(item, plan):
+                        text_bbox("0", font)
+        if layout == logo_layout and plan.logo_height:
+            for brand in registry.brands():
+                try:
+                    load_logo(registry.find(brand), plan.logo_height)
+                except Exception as e:
+                    logger.warning("Cannot preload logo for %s: %s", brand, e)
+
+
+class ServiceJob:
+    """一个渲染请求的状态, 由 HTTP 线程创建, 分发线程更新"""
+
+    def __init__(self, batch_job, source=None, keep_output=True):
+        self.id = uuid.uuid4().hex
+        self.batch_job = batch_job
+        self.source = source
+        self.keep_output = keep_output  # 为 True 时结果留在内存中返回, 否则写入 output_path
+        self.status = 'queued'
+        self.submitted = time.monotonic()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.data = None
+        self.content_type = None
+        self.done = threading.Event()
+
+    def to_dict(self):
+        info = {'id': self.id, 'status': self.status, 'image_path': self.batch_job.image_path}
+        if self.started is not None:
+            info['queued_seconds'] = round(self.started - self.submitted, 4)
+        if self.finished is not None:
+            info['total_seconds'] = round(self.finished - self.submitted, 4)
+        if self.result is not None:
+            info['render_seconds'] = round(self.result.elapsed, 4)
+            if self.result.error is not None:
+                info['error'] = self.result.error
+            elif not self.keep_output:
+                info['outputs'] = self.batch_job.output_paths
+        return info
+
+
+class RenderService:
+    """
+    常驻的渲染服务: 请求进入有界队列, 分发线程把每个请求单独提交给预热过的进程池;
+    所有进程都在渲染时, 排队的请求在有进程空闲后成组取出, 批次只用于准入和统计
+    :param workers: 工作进程数
+    :param batch_size: 一组最多的请求数, 同时提交的请求最多比进程数多 batch_size - 1 个
+    :param layouts: 预热的布局模板, 默认全部
+    """
+
+    def __init__(self, workers=None, queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE, layouts=None,
+                 layout=DEFAULT_LAYOUT):
+        self.workers = workers or default_workers()
+        self.batch_size = max(1, batch_size)
+        self.layout = layout
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._jobs = OrderedDict()
+        self._finished = deque()
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._stop = threading.Event()
+        self._running = 0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._waits = deque(maxlen=LATENCY_WINDOW)
+        self._counts = {'completed': 0, 'failed': 0, 'rejected': 0, 'batches': 0, 'batched_jobs': 0}
+        self._started = time.monotonic()
+
+        layouts = list(layouts or available_layouts())
+        self._executor = render_pool(self.workers, _warm_worker, (layouts, layout))
+        self._dispatcher = threading.Thread(target=self._dispatch, name='dispatch', daemon=True)
+
+    def start(self, wait=True):
+        """启动所有工作进程并等待预热完成"""
+        warm_ups = [self._executor.submit(os.getpid) for _ in range(self.workers)]
+        if wait:
+            for future in warm_ups:
+                future.result()
+        self._dispatcher.start()
+
+    def submit(self, job):
+        """:raises queue.Full: 队列已满时"""
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._jobs.pop(job.id, None)
+                self._counts['rejected'] += 1
+            raise
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _next_batch(self):
+        """
+        等到有空闲进程后取出已经到达的请求, 最多 batch_size 个, 不等待后续请求;
+        进程空闲时请求到达后立即取出, 只有所有进程都在渲染时排队的请求才会成组取出
+        """
+        with self._idle:
+            if not self._idle.wait_for(lambda: self._running < self.workers, timeout=0.2):
+                return []
+        try:
+            batch = [self._queue.get(timeout=0.2)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _dispatch(self):
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            if not batch:
+                continue
+            now = time.monotonic()
+            with self._lock:
+                for job in batch:
+                    job.status = 'running'
+                    job.started = now
+                    self._waits.append(now - job.submitted)
+                self._running += len(batch)
+                self._counts['batches'] += 1
+                self._counts['batched_jobs'] += len(batch)
+            # 组内的请求分别提交, 由各个空闲进程并行渲染
+            for job in batch:
+                source, job.source = job.source, None
+                try:
+                    future = self._executor.submit(render_job, job.batch_job, source, job.keep_output)
+                except RuntimeError as e:
+                    # 进程池已关闭
+                    self._fail(job, f"{type(e).__name__}: {e}")
+                    continue
+                future.add_done_callback(lambda future, job=job: self._finish(job, future))
+
+    def _fail(self, job, error):
+        self._complete(job, JobResult(job.batch_job.image_path, error=error))
+
+    def _finish(self, job, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            # 工作进程异常退出等情况
+            self._fail(job, f"{type(e).__name__}: {e}")
+            return
+        self._complete(job, result)
+
+    def _complete(self, job, result):
+        now = time.monotonic()
+        with self._lock:
+            if job.keep_output and result.encoded:
+                job.data = result.encoded[0][1]
+                job.content_type = mimetypes.guess_type(result.encoded[0][0])[0] or 'application/octet-stream'
+            result.encoded = None
+            job.result = result
+            job.finished = now
+            job.status = 'done' if result.ok else 'failed'
+            self._running -= 1
+            self._counts['completed' if result.ok else 'failed'] += 1
+            self._latencies.append(now - job.submitted)
+            self._finished.append(job.id)
+            # 只保留最近完成的任务, 长时间运行时内存不会增长
+            while len(self._finished) > FINISHED_JOBS:
+                self._jobs.pop(self._finished.popleft(), None)
+            self._idle.notify()
+        job.done.set()
+
+    def stats(self):
+        with self._lock:
+            latencies = list(self._latencies)
+            waits = list(self._waits)
+            stats = dict(self._counts)
+            stats.update(
+                workers=self.workers,
+                queue_depth=self._queue.qsize(),
+                queue_size=self._queue.maxsize,
+                running=self._running,
+                uptime=round(time.monotonic() - self._started, 1),
+            )
+        stats['mean_batch_size'] = round(stats['batched_jobs'] / stats['batches'], 2) if stats['batches'] else None
+        for name, values in (('latency', latencies), ('queue_wait', waits)):
+            stats[name] = {key: round(value, 4) if value is not None else None for key, value in (
+                ('p50', percentile(values, 0.5)),
+                ('p95', percentile(values, 0.95)),
+                ('max', max(values) if values else None),
+            )}
+        return stats
+
+    def close(self):
+        self._stop.set()
+        if self._dispatcher.is_alive():
+            self._dispatcher.join()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /render            请求体为图像文件, 或 JSON {"path": 服务器上的文件, "output_dir": ...}
+                            查询参数 profile, layout, logo, name, wait=0 时立即返回任务 id
+    GET  /jobs/<id>         任务状态
+    GET  /jobs/<id>/image   渲染结果
+    GET  /stats             队列深度、批次和延迟统计
+    """
+    server_version = "AutoWatermark"
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def log_message(self, format, *args):
+        logger.info("%s %s", self.address_string(), format % args)
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, message, **headers):
+        body = json.dumps({'error': message}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name.replace('_', '-'), value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_image(self, job):
+        self.send_response(200)
+        self.send_header("Content-Type", job.content_type)
+        self.send_header("Content-Length", str(len(job.data)))
+        self.send_header("X-Job-Id", job.id)
+        self.end_headers()
+        self.wfile.write(job.data)
+
+    def do_GET(self):
+        parts = [part for part in urlparse(self.path).path.split('/') if part]
+        if parts == ['stats']:
+            return self.send_json(200, self.service.stats())
+        if len(parts) in (2, 3) and parts[0] == 'jobs':
+            job = self.service.get(parts[1])
+            if job is None:
+                return self.send_error_json(404, "Unknown job id")
+            if len(parts) == 2:
+                return self.send_json(200, job.to_dict())
+            if parts[2] == 'image':
+                if job.data is None:
+                    return self.send_error_json(404 if job.done.is_set() else 409, "No image for this job")
+                return self.send_image(job)
+        self.send_error_json(404, "Not found")
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path.rstrip('/') != '/render':
+            # 请求体没有读取, 不能复用连接
+            self.close_connection = True
+            return self.send_error_json(404, "Not found")
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            self.close_connection = True
+            return self.send_error_json(400, "Invalid Content-Length")
+        if length <= 0:
+            return self.send_error_json(400, "Empty request body")
+        if length > MAX_UPLOAD_BYTES:
+            self.close_connection = True
+            return self.send_error_json(413, f"Request body larger than {MAX_UPLOAD_BYTES} bytes")
+        body = self.rfile.read(length)
+
+        content_type = (self.headers.get('Content-Type') or '').split(';')[0].strip().lower()
+        options = dict(query)
+        try:
+            if content_type == 'application/json':
+                fields = json.loads(body)
+                if not isinstance(fields, dict):
+                    raise ValueError("JSON body must be an object")
+                options.update(fields)
+                job = self.path_job(options)
+            else:
+                job = self.upload_job(body, content_type, options)
+        except KeyError as e:
+            return self.send_error_json(400, f"Missing field {e}")
+        except ValueError as e:
+            return self.send_error_json(400, str(e))
+
+        try:
+            self.service.submit(job)
+        except queue.Full:
+            return self.send_error_json(503, "Render queue is full", Retry_After="1")
+
+        wait = str(options.get('wait', '1')).lower() not in ('0', 'false', 'no')
+        if not wait:
+            return self.send_json(202, job.to_dict())
+        if not job.done.wait(WAIT_TIMEOUT):
+            return self.send_json(202, job.to_dict())
+        if job.status == 'failed':
+            return self.send_json(422, job.to_dict())
+        if job.data is not None:
+            return self.send_image(job)
+        self.send_json(200, job.to_dict())
+
+    @staticmethod
+    def text_option(options, name):
+        """
+        JSON 请求体中的字段可以是任意类型, 只接受字符串
+        :return: 字段的值, 没有或为空时返回 None
+        :raises ValueError: 字段不是字符串时
+        """
+        value = options.get(name)
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f"Field '{name}' must be a string")
+        return value or None
+
+    def job_settings(self, options):
+        """:raises ValueError: 输出配置或布局模板不存在时"""
+        profile = self.text_option(options, 'profile') or DEFAULT_PROFILE
+        layout = self.text_option(options, 'layout') or DEFAULT_LAYOUT
+        get_output_profile(profile)
+        get_layout(layout)
+        logo = self.text_option(options, 'logo')
+        if logo is not None and not os.path.isfile(logo):
+            raise ValueError(f"Logo '{logo}' does not exist")
+        return profile, layout, logo
+
+    def upload_job(self, body, content_type, options):
+        """上传的图像: 结果只在内存中返回, 不写入磁盘"""
+        profile, layout, logo = self.job_settings(options)
+        name = os.path.basename(self.text_option(options, 'name') or '')
+        # 名称没有图像扩展名时按 Content-Type 补上, 输出格式由扩展名决定
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            extension = UPLOAD_EXTENSIONS.get(content_type)
+            if extension is None:
+                raise ValueError(f"Unsupported upload type '{content_type}', send image/jpeg or image/png")
+            name = (name or 'upload') + extension
+        output_path = output_path_for(name, '', profile=profile)
+        return ServiceJob(BatchJob(name, logo, output_path, True, profile, layout), source=body)
+
+    def path_job(self, options):
+        """
+        服务器上的文件: 给出 output_dir 时按批处理的规则写入 (可以有多个输出), 否则返回图像
+        :raises KeyError: 没有 path 时
+        :raises ValueError: 字段类型不对、文件不存在或无法创建 output_dir 时
+        """
+        path = self.text_option(options, 'path')
+        if path is None:
+            raise KeyError('path')
+        if not os.path.isfile(path):
+            raise ValueError(f"Image '{path}' does not exist")
+        profile, layout, logo = self.job_settings(options)
+        output_dir = self.text_option(options, 'output_dir')
+        renditions = self.text_option(options, 'renditions') or DEFAULT_RENDITIONS
+        if output_dir:
+            try:
+                os.makedirs(output_dir, exist_ok=True)
+            except OSError as e:
+                raise ValueError(f"Cannot create output directory '{output_dir}': {e}")
+            batch_job, = build_jobs([path], logo, output_dir, profile=profile, layout=layout, renditions=renditions)
+            return ServiceJob(batch_job, keep_output=False)
+        output_path = output_path_for(path, '', profile=profile)
+        return ServiceJob(BatchJob(path, logo, output_path, True, profile, layout))
+
+
+def serve(host=SERVICE_HOST, port=SERVICE_PORT, workers=None, queue_size=QUEUE_SIZE, stop_event=None,
+          on_ready=None, **service_options):
+    """
+    启动服务并阻塞到 stop_event 置位
+    :param on_ready: 预热完成、开始接受请求时调用 on_ready(address)
+    :raises OSError: 无法监听 host:port 时, 此时还没有启动工作进程
+    """
+    stop_event = stop_event or threading.Event()
+    # 先绑定端口, 端口被占用时不必等待工作进程预热
+    server = ThreadingHTTPServer((host, port), RenderRequestHandler)
+    server.daemon_threads = True
+    service = None
+    try:
+        service = RenderService(workers, queue_size, **service_options)
+        service.start()
+        server.service = service
+        thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.2}, name='http',
+                                  daemon=True)
+        thread.start()
+        if on_ready is not None:
+            on_ready(server.server_address)
+        try:
+            while not stop_event.wait(0.5):
+                pass
+        finally:
+            server.shutdown()
+    finally:
+        server.server_close()
+        if service is not None:
+            service.close()
@@ -0,0 +1,97 @@
+from PIL import Image
+from collections import OrderedDict
+import threading
+import io
+import os
+
+from utils.exif_utils import get_metadata
+from utils.image_utils import reset_image_orientation
+from utils.render_utils import load_reduced_image
+
+# 缩略图列表使用的缩略图, 不依赖 PyQt5
+THUMBNAIL_SIZE = 160
+THUMBNAIL_CACHE_SIZE = 512
+
+
+def load_embedded_thumbnail(metadata):
+    """
+    读取 EXIF 中内嵌的 JPEG 缩略图, 不存在、无法解码或宽高比与原图不符
+    (部分相机会在缩略图上下加黑边) 时返回 None
+    """
+    data = metadata.exif_dict.get('thumbnail') if metadata.exif_dict else None
+    if not data:
+        return None
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except Exception:
+        return None
+    width, height = image.size
+    if abs(width / height - metadata.width / metadata.height) > 0.05:
+        return None
+    return image
+
+
+def load_thumbnail(image_path, size=THUMBNAIL_SIZE):
+    """
+    读取缩略图, 优先使用 EXIF 内嵌缩略图, 否则用 draft 模式缩小解码, 不生成全尺寸位图
+    :return: (旋转后的 RGB 缩略图, ImageMetadata)
+    :raises OSError: 文件无法打开时
+    """
+    metadata = get_metadata(image_path)
+    image = load_embedded_thumbnail(metadata)
+    if image is not None:
+        image.thumbnail((size, size), Image.LANCZOS)
+        image = reset_image_orientation(image, metadata.orientation)
+    else:
+        image = load_reduced_image(image_path, metadata.orientation, (size, size))
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return image, metadata
+
+
+class ThumbnailCache:
+    """
+    线程安全的缩略图缓存, 按 (路径, mtime, 文件大小) 保存 (缩略图, ImageMetadata),
+    超过 cache_size 时淘汰最久未使用的条目
+    """
+
+    def __init__(self, size=THUMBNAIL_SIZE, cache_size=THUMBNAIL_CACHE_SIZE):
+        self.size = size
+        self.cache_size = cache_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, image_path):
+        stat = os.stat(image_path)
+        return os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size
+
+    def get(self, image_path):
+        """:return: 缓存中的 (缩略图, ImageMetadata), 不存在时返回 None"""
+        try:
+            key = self._key(image_path)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def load(self, image_path):
+        """从缓存中取缩略图, 不存在时读取并缓存; 可以在工作线程中调用"""
+        entry = self.get(image_path)
+        if entry is not None:
+            return entry
+        key = self._key(image_path)
+        entry = load_thumbnail(image_path, self.size)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.cache_size:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,154 @@
+from contextlib import contextmanager
+import threading
+import json
+import math
+import time
+import os
+
+from utils.image_utils import image_buffer_bytes
+
+# 每张图像记录的处理阶段, 顺序即流程顺序
+STAGES = ('exif', 'logo', 'decode', 'orient', 'draw', 'encode', 'write')
+
+
+class BufferTracker:
+    """统计渲染过程中同时存在的全尺寸位图占用的内存, 用于报告每张图的峰值"""
+
+    def __init__(self):
+        self.live = 0
+        self.peak = 0
+
+    def allocate(self, image):
+        self.live += image_buffer_bytes(image.mode, image.size)
+        self.peak = max(self.peak, self.live)
+
+    def release(self, image):
+        self.live -= image_buffer_bytes(image.mode, image.size)
+
+
+class JobTrace:
+    """
+    单张图像的耗时和读写量记录
+    渲染函数通过 with trace.stage('decode'): ... 累计各阶段耗时
+    """
+
+    def __init__(self, image_path):
+        self.image_path = image_path
+        self.stages = {}
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.buffers = BufferTracker()
+        self.fields = {}
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def set(self, **fields):
+        """附加字段, 例如相机型号, 会写入日志记录"""
+        self.fields.update(fields)
+
+    def to_record(self, **extra):
+        record = {
+            'image_path': self.image_path,
+            'total': time.perf_counter() - self._start,
+            'stages': dict(self.stages),
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'peak_bytes': self.buffers.peak,
+        }
+        record.update(self.fields)
+        record.update(extra)
+        return record
+
+
+class JobLog:
+    """线程安全的 JSON Lines 日志, 每行一条记录"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def percentile(values, fraction):
+    """最近秩法求分位数, values 为空时返回 None"""
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))
+    return values[index]
+
+
+def summarize_records(records, slowest=5):
+    """
+    汇总一批记录: 每个阶段和总耗时的 p50/p95, 最慢的文件, 以及按相机型号的平均耗时
+    """
+    records = [record for record in records if record.get('stages')]
+    summary = {'images': len(records), 'stages': {}, 'slowest': [], 'cameras': {}}
+    if not records:
+        return summary
+
+    stage_names = [stage for stage in STAGES if any(stage in record['stages'] for record in records)]
+    for stage in stage_names + ['total']:
+        if stage == 'total':
+            values = [record['total'] for record in records]
+        else:
+            values = [record['stages'][stage] for record in records if stage in record['stages']]
+        summary['stages'][stage] = {'p50': percentile(values, 0.5), 'p95': percentile(values, 0.95),
+                                    'sum': sum(values)}
+
+    for record in sorted(records, key=lambda record: record['total'], reverse=True)[:slowest]:
+        summary['slowest'].append({'image_path': record['image_path'], 'total': record['total'],
+                                   'camera': record.get('camera')})
+
+    cameras = {}
+    for record in records:
+        cameras.setdefault(record.get('camera') or 'unknown', []).append(record['total'])
+    summary['cameras'] = {camera: {'images': len(values), 'mean': sum(values) / len(values)}
+                          for camera, values in sorted(cameras.items(), key=lambda item: -sum(item[1]))}
+
+    summary['bytes_read'] = sum(record.get('bytes_read', 0) for record in records)
+    summary['bytes_written'] = sum(record.get('bytes_written', 0) for record in records)
+    return summary
+
+
+def format_summary(summary):
+    """把 summarize_records 的结果格式化为多行文本"""
+    lines = [f"{summary['images']} images"]
+    if not summary['images']:
+        return lines[0]
+    lines.append(f"{'stage':<8} {'p50':>9} {'p95':>9} {'total':>9}")
+    for stage, values in summary['stages'].items():
+        lines.append(f"{stage:<8} {values['p50'] * 1000:>7.0f}ms {values['p95'] * 1000:>7.0f}ms {values['sum']:>8.1f}s")
+    lines.append(f"read {summary['bytes_read'] / 2 ** 20:.1f} MB, written {summary['bytes_written'] / 2 ** 20:.1f} MB")
+    lines.append("slowest:")
+    for item in summary['slowest']:
+        lines.append(f"  {item['total']:.2f}s  {item['image_path']}  ({item.get('camera') or 'unknown'})")
+    lines.append("by camera:")
+    for camera, values in summary['cameras'].items():
+        lines.append(f"  {camera}: {values['images']} images, {values['mean']:.2f}s mean")
+    return '\n'.join(lines)
@@ -0,0 +1,323 @@
+from collections import deque
+import ctypes
+import ctypes.util
+import logging
+import select
+import signal
+import struct
+import time
+import os
+
+from utils.batch_utils import IMAGE_EXTENSIONS, BudgetedPool, build_jobs, default_workers, is_inside, render_job
+from utils.manifest_utils import OutputManifest
+
+# 监视目录, 文件写完后自动渲染; Linux 上使用 inotify, 其它系统或 inotify 不可用时定时扫描目录
+
+logger = logging.getLogger(__name__)
+
+# 文件大小和修改时间保持不变多少秒后才认为已经写完
+SETTLE_SECONDS = 1.0
+POLL_INTERVAL = 1.0
+# 每隔多少秒或多少张图保存一次清单
+MANIFEST_SAVE_INTERVAL = 5.0
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_MASK = IN_CREATE | IN_CLOSE_WRITE | IN_MOVED_TO
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+def list_directories(directories, recursive=False):
+    result = []
+    for directory in directories:
+        if recursive:
+            for root, dirs, _ in os.walk(directory):
+                dirs.sort()
+                result.append(root)
+        else:
+            result.append(directory)
+    return result
+
+
+def list_images(directories, recursive=False):
+    images = []
+    for directory in list_directories(directories, recursive):
+        try:
+            entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+        except OSError:
+            continue
+        images.extend(entry.path for entry in entries
+                      if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS))
+    return images
+
+
+class PollingSource:
+    """定时扫描目录, 返回大小或修改时间发生变化的文件"""
+
+    def __init__(self, directories, recursive=False, interval=POLL_INTERVAL):
+        self.directories = directories
+        self.recursive = recursive
+        self.interval = interval
+        self._last_scan = 0.0
+        self._seen = {}
+
+    def _scan(self):
+        seen = {}
+        for path in list_images(self.directories, self.recursive):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            seen[path] = (stat.st_size, stat.st_mtime_ns)
+        return seen
+
+    def changes(self, timeout):
+        delay = self.interval - (time.monotonic() - self._last_scan)
+        if delay > 0:
+            time.sleep(min(delay, timeout))
+            if time.monotonic() - self._last_scan < self.interval:
+                return set()
+        self._last_scan = time.monotonic()
+        seen = self._scan()
+        changed = {path for path, signature in seen.items() if self._seen.get(path) != signature}
+        self._seen = seen
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifySource:
+    """
+    通过 ctypes 调用 libc 的 inotify, 只关心新建、写完关闭和移入的文件
+    :raises OSError: 当前系统不支持 inotify 时
+    """
+
+    def __init__(self, directories, recursive=False):
+        libc_name = ctypes.util.find_library('c')
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError("inotify is not available")
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories = directories
+        self.recursive = recursive
+        self._watches = {}
+        for directory in list_directories(directories, recursive):
+            self._add_watch(directory)
+
+    def _add_watch(self, directory):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), INOTIFY_MASK)
+        if wd < 0:
+            logger.warning("Cannot watch %s: %s", directory, os.strerror(ctypes.get_errno()))
+            return
+        self._watches[wd] = directory
+
+    def changes(self, timeout):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        changed = set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset + INOTIFY_EVENT.size <= len(data):
+            wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            name = data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length].rstrip(b'\0')
+            offset += INOTIFY_EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                # 内核队列溢出时丢失了事件, 重新扫描全部目录
+                logger.warning("inotify queue overflowed, rescanning")
+                changed.update(list_images(self.directories, self.recursive))
+                continue
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            directory = self._watches.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if self.recursive and mask & (IN_CREATE | IN_MOVED_TO):
+                    # 新目录中可能已经有文件
+                    for sub_directory in list_directories([path], True):
+                        self._add_watch(sub_directory)
+                    changed.update(list_images([path], True))
+                continue
+            changed.add(path)
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class FolderWatcher:
+    """
+    监视目录中的新图像, 文件大小和修改时间连续 settle 秒不变时才返回, 避免读取写了一半的文件;
+    短时间内多次写入同一个文件只返回一次
+    :param exclude: 不监视的目录, 例如位于输入目录中的输出目录
+    :param use_inotify: None 时在支持的系统上使用 inotify
+    """
+
+    def __init__(self, directories, recursive=False, settle=SETTLE_SECONDS, exclude=(), use_inotify=None,
+                 poll_interval=POLL_INTERVAL):
+        self.directories = [os.path.abspath(directory) for directory in directories]
+        self.recursive = recursive
+        self.settle = settle
+        self.exclude = tuple(os.path.abspath(path) + os.sep for path in exclude)
+        self.source = None
+        if use_inotify is not False:
+            try:
+                self.source = InotifySource(self.directories, recursive)
+            except (OSError, AttributeError) as e:
+                if use_inotify:
+                    raise
+                logger.info("inotify unavailable (%s), polling every %.1fs", e, poll_interval)
+        if self.source is None:
+            self.source = PollingSource(self.directories, recursive, poll_interval)
+        self._pending = {}
+        # 启动前已经存在的文件也要处理, 同样等待写完
+        self._track(list_images(self.directories, recursive))
+
+    def _track(self, paths):
+        now = time.monotonic()
+        for path in paths:
+            path = os.path.abspath(path)
+            if not path.lower().endswith(IMAGE_EXTENSIONS) or path.startswith(self.exclude):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            previous = self._pending.get(path)
+            if previous is None or previous[0] != signature:
+                self._pending[path] = (signature, now)
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def poll(self, timeout=1.0):
+        """
+        等待最多 timeout 秒
+        :return: 已经写完的新文件路径列表
+        """
+        if self._pending:
+            timeout = min(timeout, self.settle / 2)
+        self._track(self.source.changes(timeout))
+
+        now = time.monotonic()
+        ready = []
+        for path, (signature, since) in list(self._pending.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self._pending[path]
+                continue
+            current = (stat.st_size, stat.st_mtime_ns)
+            if current != signature:
+                self._pending[path] = (current, now)
+            elif now - since >= self.settle and stat.st_size > 0:
+                del self._pending[path]
+                ready.append(path)
+        return sorted(ready)
+
+    def close(self):
+        self.source.close()
+
+
+def _ignore_interrupt():
+    """工作进程忽略 Ctrl-C, 由主进程决定何时停止, 正在渲染的图像可以完成"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def watch_folders(directories, logo_path, output_dir, auto_logo=True, workers=None, recursive=False,
+                  settle=SETTLE_SECONDS, queue_size=None, on_result=None, stop_event=None, use_inotify=None,
+                  pixel_budget=None, prune=False, **job_options):
+    """
+    持续监视 directories, 文件写完后渲染到 output_dir, 直到 stop_event 置位
+    最多 queue_size 张图在渲染或排队, 队列满时暂停读取新文件 (inotify 事件留在内核队列中);
+    停止时等待正在渲染的图像完成并保存清单, 下次启动会跳过已经渲染过且没有变化的文件
+    :param job_options: 传给 build_jobs 的 name_template, profile, layout
+    :param on_result: 每完成一张调用 on_result(done, pending, result), pending 为尚未完成的文件数
+    :param pixel_budget: 同时渲染的最大像素数, 见 run_batch
+    :param prune: 启动时删除清单中所有输入已不存在的旧输出, 不限于 directories, 见 OutputManifest.prune
+    :return: 完成的 JobResult 数量
+    :raises ValueError: job_options 中的输出配置或输出组无效时, 此时不会开始监视
+    """
+    # 提前检查设置, 避免在第一张图到达时才失败
+    build_jobs([], logo_path, output_dir, auto_logo, **job_options)
+    workers = workers or default_workers()
+    queue_size = queue_size or workers * 2
+    manifest = OutputManifest.load(output_dir)
+    manifest.prune(directories, recursive, force=prune)
+    # 输出目录是监视目录或包含监视目录时不能整体排除, 只跳过本程序写出的文件
+    covers_input = any(is_inside(directory, output_dir) for directory in directories)
+    watcher = FolderWatcher(directories, recursive, settle, exclude=[] if covers_input else [output_dir],
+                            use_inotify=use_inotify)
+    produced = manifest.output_paths()
+    backlog = deque()
+    done = 0
+    last_save = time.monotonic()
+    unsaved = 0
+
+    def stopped():
+        return stop_event is not None and stop_event.is_set()
+
+    def finish(result):
+        nonlocal done, unsaved, last_save
+        manifest.record(result)
+        done += 1
+        unsaved += 1
+        if on_result is not None:
+            on_result(done, len(backlog) + watcher.pending, result)
+        if unsaved and time.monotonic() - last_save >= MANIFEST_SAVE_INTERVAL:
+            manifest.save()
+            last_save, unsaved = time.monotonic(), 0
+
+    def enqueue(paths):
+        paths = [path for path in paths if os.path.abspath(path) not in produced]
+        jobs = build_jobs(paths, logo_path, output_dir, auto_logo, **job_options)
+        for job in jobs:
+            produced.update(os.path.abspath(output_path) for output_path in job.output_paths)
+        pending, _ = manifest.plan(jobs)
+        backlog.extend(pending)
+
+    pool = BudgetedPool(workers, pixel_budget, initializer=_ignore_interrupt) if workers > 1 else None
+    try:
+        while not stopped():
+            # 队列满时不再读取新事件, 由内核或下一次扫描保留
+            if len(backlog) + (len(pool) if pool is not None else 0) < queue_size:
+                ready = watcher.poll(0.2 if (backlog or pool) else 1.0)
+                if ready:
+                    enqueue(ready)
+            if pool is None:
+                if backlog:
+                    finish(render_job(backlog.popleft()))
+                continue
+            while backlog and len(pool) < workers and pool.submit(backlog[0]):
+                backlog.popleft()
+            for _, result in pool.completed(0.2):
+                finish(result)
+        # 正常停止: 等待已经开始的任务完成, 排队中的留到下次启动
+        if pool is not None:
+            for _, result in pool.completed():
+                finish(result)
+    finally:
+        if pool is not None:
+            pool.close(cancel=True)
+        watcher.close()
+        manifest.save()
+    return done